@@ -0,0 +1,2 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Benchmarks for the performance-sensitive parts of inferhotspot."""
@@ -0,0 +1,58 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Benchmark census block lookup cost against the number of blocks.
+
+Compares the linear scan done by `process.point_to_block` on a plain
+dictionary of blocks with a lookup through `process.BlockIndex`.
+
+Run using the command: `python -m benchmarks.block_index`
+"""
+from __future__ import division
+import random
+import timeit
+
+import shapely.geometry
+
+from benchmarks.generators import make_blocks
+from inferhotspot import process
+
+
+def random_points(count, side, origin=(-97.4, 32.9), size=0.001, seed=0):
+    """Create random points that fall within a grid from `make_blocks`."""
+    rand = random.Random(seed)
+    extent = side * size
+    return [shapely.geometry.Point(origin[0] + rand.random() * extent,
+                                   origin[1] + rand.random() * extent)
+            for _ in xrange(count)]
+
+
+def time_lookups(points, blocks):
+    """Mean seconds per `point_to_block` lookup."""
+    timer = timeit.default_timer
+    start = timer()
+    for point in points:
+        process.point_to_block(point, blocks)
+    return (timer() - start) / len(points)
+
+
+def main(sides=(10, 30, 100, 300), lookups=200):
+    row = '{0:>8}  {1:>14}  {2:>14}  {3:>10}'
+    print row.format('blocks', 'linear (us)', 'index (us)', 'build (s)')
+    for side in sides:
+        blocks = make_blocks(side)
+        points = random_points(lookups, side)
+        timer = timeit.default_timer
+        start = timer()
+        index = process.BlockIndex(blocks)
+        build = timer() - start
+        # The linear scan is far too slow to run on every point at the
+        # larger sizes, so only a few points are timed.
+        linear = time_lookups(points[:max(1, lookups // side)], blocks)
+        indexed = time_lookups(points, index)
+        print row.format(len(blocks),
+                         '{0:.1f}'.format(linear * 1e6),
+                         '{0:.1f}'.format(indexed * 1e6),
+                         '{0:.2f}'.format(build))
+
+
+if __name__ == '__main__':
+    main()
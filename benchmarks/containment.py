@@ -0,0 +1,202 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Benchmark the containment tests of points in census blocks.
+
+Each random point is tested against the census blocks whose bounds are
+near it, the same candidates that `process.BlockIndex` tests, using the
+raw geometries, the prepared geometries, and the bounds followed by the
+prepared geometries. The throughput of `BlockIndex.find` and
+`BlockIndex.assign` is reported as well.
+
+Census blocks are square in the grid of `benchmarks.block_index`, which
+makes their bounds an exact test, so by default the blocks are instead
+irregular polygons with jagged shared edges, like real census blocks.
+Real census blocks can be used by passing the path of a census blocks
+file, as in the `[census]` section of the configuration file.
+
+Run using the command: `python -m benchmarks.containment`
+"""
+from __future__ import division
+import argparse
+import random
+import timeit
+
+import numpy
+import shapely.geometry
+import shapely.prepared
+
+from inferhotspot import process
+
+
+def make_irregular_blocks(side, detail=10, origin=(-97.4, 32.9),
+                          size=0.001, seed=0):
+    """Create a grid of irregular census blocks that share their edges.
+
+    Args:
+        side: Number of blocks along each side of the grid.
+        detail: Number of vertices along each edge of a block.
+        origin: Longitude and latitude pair of the southwest corner.
+        size: Float of the mean width and height of each block in
+            degrees.
+        seed: Seed for the random number generator.
+
+    Returns:
+        Dictionary of MultiPolygon objects with a block ID as the key,
+        in the same form as returned by `process.extract_blocks`.
+    """
+    rand = random.Random(seed)
+    corners = dict()
+    for col in xrange(side + 1):
+        for row in xrange(side + 1):
+            # The corners on the outside of the grid stay on its border.
+            dx = rand.uniform(-0.25, 0.25) if 0 < col < side else 0
+            dy = rand.uniform(-0.25, 0.25) if 0 < row < side else 0
+            corners[col, row] = (origin[0] + (col + dx) * size,
+                                 origin[1] + (row + dy) * size)
+    edges = dict()
+
+    def edge(start, end):
+        """Jagged vertices from one corner to another, shared by both
+        of the blocks on either side of the edge."""
+        key = tuple(sorted([start, end]))
+        if key not in edges:
+            (x0, y0), (x1, y1) = corners[key[0]], corners[key[1]]
+            inner = key[0][0] == key[1][0] and 0 < key[0][0] < side
+            inner |= key[0][1] == key[1][1] and 0 < key[0][1] < side
+            points = [(x0, y0)]
+            for step in xrange(1, detail):
+                t = step / detail
+                # The noise tapers off towards the corners, so that the
+                # edges of a block cannot cross where they meet.
+                noise = 0
+                if inner:
+                    noise = rand.uniform(-0.2, 0.2) * t * (1 - t) * size
+                points.append((x0 + t * (x1 - x0) - noise * (y1 - y0) / size,
+                               y0 + t * (y1 - y0) + noise * (x1 - x0) / size))
+            edges[key] = points
+        points = edges[key]
+        if key[0] != start:
+            points = [corners[start]] + points[:0:-1]
+        return points
+
+    blocks = dict()
+    for col in xrange(side):
+        for row in xrange(side):
+            ring = []
+            square = [(col, row), (col + 1, row), (col + 1, row + 1),
+                      (col, row + 1), (col, row)]
+            for start, end in process.bigrams(square):
+                ring.extend(edge(start, end))
+            polygon = shapely.geometry.Polygon(ring)
+            assert polygon.is_valid, (col, row)
+            block_id = '{0:06d}{1:06d}'.format(col, row)
+            blocks[block_id] = shapely.geometry.MultiPolygon([polygon])
+    return blocks
+
+
+def random_coordinates(count, bounds, seed=0):
+    """Random longitude and latitude arrays within the overall bounds."""
+    rand = numpy.random.RandomState(seed)
+    longitude = rand.uniform(bounds[:, 0].min(), bounds[:, 2].max(), count)
+    latitude = rand.uniform(bounds[:, 1].min(), bounds[:, 3].max(), count)
+    return longitude, latitude
+
+
+def candidate_pairs(index, longitude, latitude):
+    """Pairs of a point and each block with bounds within a cell of it.
+
+    Args:
+        index: A `process.BlockIndex`.
+        longitude: NumPy float array of the point longitudes.
+        latitude: NumPy float array of the point latitudes.
+
+    Returns:
+        List of tuples of a shapely.geometry.Point, its longitude and
+        latitude, and the position of a block in `index.block_ids`.
+    """
+    bounds = index.bounds
+    margin = index.cell_size
+    pairs = []
+    for x, y in zip(longitude, latitude):
+        near = numpy.flatnonzero((bounds[:, 0] - margin <= x) &
+                                 (bounds[:, 2] + margin >= x) &
+                                 (bounds[:, 1] - margin <= y) &
+                                 (bounds[:, 3] + margin >= y))
+        point = shapely.geometry.Point(x, y)
+        pairs.extend((point, x, y, position) for position in near)
+    return pairs
+
+
+def raw_test(geometry, bounds, point, x, y):
+    return geometry.contains(point)
+
+
+def prepared_test(prepared, bounds, point, x, y):
+    return prepared.contains(point)
+
+
+def bounds_prepared_test(prepared, bounds, point, x, y):
+    min_x, min_y, max_x, max_y = bounds
+    return (min_x <= x <= max_x and min_y <= y <= max_y and
+            prepared.contains(point))
+
+
+def tests_per_second(test, geometries, bounds, pairs):
+    """Containment tests per second, and the number of points found."""
+    timer = timeit.default_timer
+    start = timer()
+    found = 0
+    for point, x, y, position in pairs:
+        if test(geometries[position], bounds[position], point, x, y):
+            found += 1
+    return len(pairs) / (timer() - start), found
+
+
+def main(blocks=None, side=100, points=2000):
+    if blocks is None:
+        blocks = make_irregular_blocks(side)
+    index = process.BlockIndex(blocks)
+    geometries = [blocks[x] for x in index.block_ids]
+    prepared = [shapely.prepared.prep(x) for x in geometries]
+    bounds = [tuple(x) for x in index.bounds]
+    longitude, latitude = random_coordinates(points, index.bounds)
+    pairs = candidate_pairs(index, longitude, latitude)
+    vertices = sum(len(x.exterior.coords)
+                   for geometry in geometries for x in geometry.geoms)
+    print 'blocks: {0}\tvertices/block: {1:.0f}\ttests: {2}'.format(
+        len(geometries), vertices / len(geometries), len(pairs))
+
+    expected = None
+    for name, test, shapes in [('raw', raw_test, geometries),
+                               ('prepared', prepared_test, prepared),
+                               ('bounds+prepared', bounds_prepared_test,
+                                prepared)]:
+        rate, found = tests_per_second(test, shapes, bounds, pairs)
+        if expected is None:
+            expected = found
+        assert found == expected, name
+        print '{0:>16}  {1:>10.0f} tests/sec'.format(name, rate)
+
+    timer = timeit.default_timer
+    points = [shapely.geometry.Point(x, y)
+              for x, y in zip(longitude, latitude)]
+    start = timer()
+    found = [index.find(point) for point in points]
+    find_rate = len(points) / (timer() - start)
+    index = process.BlockIndex(blocks)
+    start = timer()
+    positions = index.assign(longitude, latitude)
+    assign_rate = len(points) / (timer() - start)
+    assert found == [index.block_ids[x] if x >= 0 else None
+                     for x in positions]
+    print '{0:>16}  {1:>10.0f} points/sec'.format('find', find_rate)
+    print '{0:>16}  {1:>10.0f} points/sec'.format('assign', assign_rate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('census_blocks', nargs='?',
+                        help='path of a census blocks file to use instead '
+                             'of synthetic blocks')
+    args = parser.parse_args()
+    main(process.load_blocks(args.census_blocks)
+         if args.census_blocks else None)
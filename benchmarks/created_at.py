@@ -0,0 +1,79 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Benchmark `process.parse_created_at` against `dateutil.parser.parse`.
+
+Before timing, every generated time is checked to parse to the same
+timezone aware datetime with both functions.
+
+Run using the command: `python -m benchmarks.created_at`
+"""
+from __future__ import division
+import datetime
+import random
+import timeit
+
+import dateutil.parser
+
+from inferhotspot import process
+
+
+def make_times(count, tweets_per_second=3, seed=0):
+    """Create created-at strings of a stream of tweets.
+
+    Args:
+        count: Number of created-at strings.
+        tweets_per_second: Mean number of tweets sharing each second.
+        seed: Seed for the random number generator.
+
+    Returns:
+        List of created-at strings in increasing time order.
+    """
+    rand = random.Random(seed)
+    created_at = datetime.datetime(2013, 2, 12, 6, 33, 37)
+    times = []
+    for _ in xrange(count):
+        if rand.random() < 1 / tweets_per_second:
+            created_at += datetime.timedelta(seconds=rand.randint(1, 60))
+        times.append(created_at.strftime('%a %b %d %H:%M:%S +0000 %Y'))
+    return times
+
+
+def check_equivalence(times):
+    """Raise AssertionError if any time parses differently."""
+    unexpected = ['Tue, 12 Feb 2013 06:33:37 +0000',
+                  'Tue Feb 12 06:33:37 -0500 2013',
+                  'Tue Feb 12 06:33:37 2013']
+    for created_at in times + unexpected:
+        expected = dateutil.parser.parse(created_at)
+        parsed = process.parse_created_at(created_at)
+        assert parsed == expected, (created_at, parsed, expected)
+        assert parsed.utcoffset() == expected.utcoffset(), created_at
+
+
+def time_parser(parser, times):
+    """Mean seconds per parsed created-at string."""
+    timer = timeit.default_timer
+    start = timer()
+    for created_at in times:
+        parser(created_at)
+    return (timer() - start) / len(times)
+
+
+def main(count=100000):
+    times = make_times(count)
+    check_equivalence(times[:1000])
+    process._created_at_cache.clear()
+
+    dateutil_time = time_parser(dateutil.parser.parse, times)
+    process._created_at_cache.clear()
+    fast_time = time_parser(lambda x: process.parse_created_at(x, 0), times)
+    process._created_at_cache.clear()
+    cached_time = time_parser(process.parse_created_at, times)
+
+    print 'times: {0} ({1} unique)'.format(count, len(set(times)))
+    print 'dateutil: {0:.2f} us'.format(dateutil_time * 1e6)
+    print 'fixed-format: {0:.2f} us'.format(fast_time * 1e6)
+    print 'fixed-format with cache: {0:.2f} us'.format(cached_time * 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Benchmark the lines per second of `filter.filter_archive`.
+
+A synthetic bz2-archive of tweets is filtered once with the standard
+library JSON decoder and no precheck (how every line used to be
+handled), and once with the precheck and the fastest available decoder.
+
+Run using the command: `python -m benchmarks.filter`
+"""
+from __future__ import division
+import json
+import os
+import shutil
+import tempfile
+import timeit
+
+from benchmarks.generators import BOX, make_archive
+from inferhotspot import filter as tweet_filter
+
+
+def lines_per_second(fname, filters):
+    """Lines per second of `filter_archive` on the archive."""
+    status = tweet_filter.FilterStatus()
+    timer = timeit.default_timer
+    start = timer()
+    with open(os.devnull, mode='w') as out:
+        tweet_filter.filter_archive(fname, out, filters, status)
+    return status.total / (timer() - start)
+
+
+def main(lines=50000):
+    directory = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(directory, 'tweets.json.bz2')
+        make_archive(fname, lines)
+        in_box = tweet_filter.FilterInBox(BOX)
+
+        backend = tweet_filter.json_backend
+        tweet_filter.json_backend = json
+        try:
+            # A plain function hides the precheck of the filter.
+            before = lines_per_second(fname, [lambda tweet: in_box(tweet)])
+        finally:
+            tweet_filter.json_backend = backend
+        after = lines_per_second(fname, [in_box])
+
+        print 'lines: {0}'.format(lines)
+        print 'before (json, no precheck): {0:.0f} lines/sec'.format(before)
+        print 'after ({0}, precheck): {1:.0f} lines/sec'.format(
+            backend.__name__, after)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
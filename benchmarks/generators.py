@@ -0,0 +1,188 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Deterministic generators of synthetic tweets and census blocks.
+
+The generated files have the same formats as the real data, so they can
+be given to any stage of the package: bz2-archives with a JSON encoded
+tweet on each line, and bz2-archives of census blocks with a block ID
+and the hex encoded WKB of its geometry on each tab separated line. The
+same arguments and seed always give the same data.
+"""
+from __future__ import division
+import bz2
+import datetime
+import json
+import random
+
+import shapely.geometry
+import shapely.wkb
+
+
+BOX = [-97.399786, 32.989759, -96.834612, 33.413174]
+
+
+def make_tweet(rand, geocoded, user_id=None, created_at=None, point=None,
+               box=BOX):
+    """Create a tweet with roughly the size and shape of a real one.
+
+    Args:
+        rand: The `random.Random` object to use.
+        geocoded: Boolean whether the tweet has a coordinates-point.
+        user_id: The user ID of the tweet. (Default: random)
+        created_at: String of the created-at time of the tweet.
+            (Default: 'Tue Feb 12 06:33:37 +0000 2013')
+        point: Longitude and latitude pair of a geocoded tweet.
+            (Default: a random point in `box`)
+        box: Flat list of the bounding box of the tweet's place, with
+            the southwest corner coming first.
+
+    Returns:
+        Dictionary of the tweet, as decoded from the Streaming API.
+    """
+    place_box = [[box[0], box[1]], [box[0], box[3]],
+                 [box[2], box[3]], [box[2], box[1]]]
+    tweet = {
+        'created_at': created_at or 'Tue Feb 12 06:33:37 +0000 2013',
+        'id': rand.getrandbits(60),
+        'text': ' '.join('word{0}'.format(rand.randint(0, 999))
+                         for _ in xrange(rand.randint(3, 20))),
+        'source': '<a href="http://twitter.com/download/iphone">iPhone</a>',
+        'truncated': False,
+        'in_reply_to_status_id': None,
+        'user': {
+            'id': (rand.randint(1, 10 ** 6) if user_id is None
+                   else user_id),
+            'screen_name': 'user{0}'.format(rand.randint(1, 10 ** 6)),
+            'description': 'x' * rand.randint(0, 160),
+            'followers_count': rand.randint(0, 5000),
+            'profile_image_url': 'http://a0.twimg.com/profile_images/x.png',
+            'profile_background_color': 'C0DEED',
+            'lang': 'en',
+        },
+        'geo': None,
+        'coordinates': None,
+        'place': {
+            'id': '6e315e1f96e0d8be',
+            'full_name': 'Denton, TX',
+            'place_type': 'city',
+            'bounding_box': {'type': 'Polygon', 'coordinates': [place_box]},
+        },
+        'entities': {'hashtags': [], 'urls': [], 'user_mentions': []},
+        'retweet_count': 0,
+        'favorited': False,
+        'lang': 'en',
+    }
+    if geocoded:
+        if point is None:
+            point = (box[0] + rand.random() * (box[2] - box[0]),
+                     box[1] + rand.random() * (box[3] - box[1]))
+        longitude, latitude = point
+        tweet['geo'] = {'type': 'Point', 'coordinates': [latitude, longitude]}
+        tweet['coordinates'] = {'type': 'Point',
+                                'coordinates': [longitude, latitude]}
+    return tweet
+
+
+def make_archive(fname, lines, geocoded_ratio=0.1, users=None, spread=0.02,
+                 box=BOX, seed=0):
+    """Write a synthetic bz2-archive of JSON encoded tweets.
+
+    The tweets are in created-at order, a few seconds apart, starting on
+    Tue Feb 12 2013.
+
+    Args:
+        fname: String of the path of the archive to write.
+        lines: Number of tweets.
+        geocoded_ratio: Float of the fraction of tweets that have a
+            coordinates-point within `box`.
+        users: Number of users making the geocoded tweets, so that each
+            user makes `lines * geocoded_ratio / users` check-ins on
+            average. Each user's check-ins are spread around a random
+            home point. (Default: None, a random user and point for
+            every tweet.)
+        spread: Float of the standard deviation of the distance of a
+            user's check-ins from their home, as a fraction of the size
+            of `box`.
+        box: Flat list of the bounding box, with the southwest corner
+            coming first.
+        seed: Seed for the random number generator.
+    """
+    rand = random.Random(seed)
+    homes = None
+    if users:
+        homes = [(box[0] + rand.random() * (box[2] - box[0]),
+                  box[1] + rand.random() * (box[3] - box[1]))
+                 for _ in xrange(users)]
+    created_at = datetime.datetime(2013, 2, 12, 6, 33, 37)
+    with bz2.BZ2File(fname, mode='w') as archive:
+        for _ in xrange(lines):
+            created_at += datetime.timedelta(seconds=rand.randint(0, 5))
+            geocoded = rand.random() < geocoded_ratio
+            user_id = point = None
+            if geocoded and homes:
+                user_id = rand.randint(1, users)
+                point = _near(rand, homes[user_id - 1], spread, box)
+            tweet = make_tweet(
+                rand, geocoded, user_id,
+                created_at.strftime('%a %b %d %H:%M:%S +0000 %Y'), point, box)
+            archive.write(json.dumps(tweet, separators=(',', ':')) + '\n')
+
+
+def _near(rand, home, spread, box):
+    """Random point within the box near a home point."""
+    while True:
+        longitude = rand.gauss(home[0], spread * (box[2] - box[0]))
+        latitude = rand.gauss(home[1], spread * (box[3] - box[1]))
+        if box[0] < longitude < box[2] and box[1] < latitude < box[3]:
+            return longitude, latitude
+
+
+def make_blocks(side, origin=(-97.4, 32.9), size=0.001):
+    """Create a square grid of square census blocks.
+
+    Args:
+        side: Number of blocks along each side of the grid.
+        origin: Longitude and latitude pair of the southwest corner.
+        size: Float of the width and height of each block in degrees.
+
+    Returns:
+        Dictionary of MultiPolygon objects with a block ID as the key,
+        in the same form as returned by `process.extract_blocks`.
+    """
+    blocks = dict()
+    for col in xrange(side):
+        for row in xrange(side):
+            x = origin[0] + col * size
+            y = origin[1] + row * size
+            polygon = shapely.geometry.box(x, y, x + size, y + size)
+            block_id = '{0:06d}{1:06d}'.format(col, row)
+            blocks[block_id] = shapely.geometry.MultiPolygon([polygon])
+    return blocks
+
+
+def make_box_blocks(side, box=BOX):
+    """Create a grid from `make_blocks` that covers a bounding box.
+
+    Args:
+        side: Number of blocks along each side of the grid.
+        box: Flat list of the bounding box, with the southwest corner
+            coming first.
+
+    Returns:
+        Dictionary of MultiPolygon objects with a block ID as the key.
+    """
+    size = max(box[2] - box[0], box[3] - box[1]) / side
+    return make_blocks(side, origin=box[:2], size=size)
+
+
+def write_blocks(fname, blocks):
+    """Write census blocks to a bz2-archive in the census blocks format.
+
+    Args:
+        fname: String of the path of the archive to write.
+        blocks: Dictionary of geometry objects with a block ID as the
+            key, as from `make_blocks`.
+    """
+    with bz2.BZ2File(fname, mode='w') as archive:
+        for block_id in sorted(blocks):
+            geometry = shapely.wkb.dumps(blocks[block_id]).encode('hex')
+            archive.write('\t'.join([block_id, geometry]) + '\n')
@@ -0,0 +1,75 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Benchmark `process.compute_block_interactions` with worker processes.
+
+Synthetic users with check-ins on a grid of census blocks are counted
+with several numbers of worker processes. Before timing, the result of
+every number of workers is checked to be the same as the result of a
+single process.
+
+Run using the command: `python -m benchmarks.interactions`
+"""
+from __future__ import division
+import random
+import timeit
+
+from benchmarks.generators import make_blocks
+from inferhotspot import process
+
+
+def make_users(count, side, checkins=20, origin=(-97.4, 32.9), size=0.001,
+               seed=0):
+    """Create users with check-ins in a grid from `make_blocks`.
+
+    Args:
+        count: Number of users.
+        side: Number of blocks along each side of the grid.
+        checkins: Mean number of check-ins per user.
+        origin: Longitude and latitude pair of the southwest corner.
+        size: Float of the width and height of each block in degrees.
+        seed: Seed for the random number generator.
+
+    Returns:
+        Dictionary in the same form as the `users` of
+        `process.process_data`.
+    """
+    rand = random.Random(seed)
+    extent = side * size
+    users = dict()
+    for user in xrange(count):
+        users[user] = [(origin[0] + rand.random() * extent,
+                        origin[1] + rand.random() * extent)
+                       for _ in xrange(rand.randint(1, 2 * checkins - 1))]
+    return users
+
+
+def time_workers(users, blocks, workers):
+    """Seconds to compute the interactions, and the interactions."""
+    timer = timeit.default_timer
+    start = timer()
+    interactions = process.compute_block_interactions(users, blocks,
+                                                      workers)
+    return timer() - start, interactions
+
+
+def main(side=300, users=50000, worker_counts=(1, 2, 4, 8)):
+    grid = make_blocks(side)
+    blocks = process.BlockIndex(grid)
+    users = make_users(users, side)
+    checkins = sum(len(x) for x in users.itervalues())
+    print 'blocks: {0}\tusers: {1}\tcheck-ins: {2}'.format(
+        len(blocks), len(users), checkins)
+    expected = None
+    for workers in worker_counts:
+        # A new index for each run, so that no run reuses the prepared
+        # geometries of an earlier one.
+        blocks = process.BlockIndex(grid)
+        seconds, interactions = time_workers(users, blocks, workers)
+        if expected is None:
+            expected = interactions
+        assert interactions == expected, workers
+        print 'workers: {0}\t{1:.2f} s\t{2:.0f} check-ins/sec'.format(
+            workers, seconds, checkins / seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Load test the web server with different numbers of worker processes.
+
+Synthetic census blocks and interactions are written to a temporary
+directory and loaded the same way as `web.py` does, as memory-mapped
+files, and then the server is started with each `[web] processes`
+setting. Several client processes request `/api/interaction/blocks` as
+fast as they can, and the requests per second are reported.
+
+Run using the command: `python -m benchmarks.load_test`
+"""
+from __future__ import division
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import urllib2
+
+from benchmarks.generators import make_blocks, write_blocks
+from benchmarks.web import make_interactions, query_urls
+from inferhotspot import config
+from inferhotspot import process
+from inferhotspot import web
+
+
+def write_data(directory, side, targets=20):
+    """Write synthetic census blocks and interactions files.
+
+    Args:
+        directory: String of the directory to write the files to.
+        side: Number of blocks along each side of the grid.
+        targets: Number of target blocks of each source block.
+
+    Returns:
+        Tuple of the paths of the census blocks archive and of the
+        interactions file.
+    """
+    blocks = make_blocks(side)
+    blocks_fname = os.path.join(directory, 'census-blocks.tsv.bz2')
+    write_blocks(blocks_fname, blocks)
+    interactions = make_interactions(sorted(blocks), targets)
+    interactions_fname = os.path.join(directory,
+                                      'census-block-interactions.tsv')
+    with open(interactions_fname, mode='w') as f:
+        process.dump_interactions(interactions, f)
+    return blocks_fname, interactions_fname
+
+
+def unused_port():
+    """Find a port number that is not in use."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def run_server(directory, blocks_fname, interactions_fname, port, processes):
+    """Load the data files and serve them; runs in a child process."""
+    # Put the server and its forked workers in their own process group,
+    # so that they can all be stopped together.
+    os.setpgrp()
+    store = os.path.join(directory, 'census-blocks.store')
+    blocks = process.BlockIndex(process.load_blocks(blocks_fname, store))
+    interactions = process.load_interaction_matrix(interactions_fname)
+    settings = config.create_default_config()
+    settings.set('web', 'port', str(port))
+    settings.set('web', 'debug', 'False')
+    settings.set('web', 'processes', str(processes))
+    web.start_server(settings, blocks, interactions, (None, None))
+
+
+def wait_until_ready(port, timeout=60):
+    """Wait for the server to respond to requests."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            urllib2.urlopen('http://127.0.0.1:{0}/status'.format(port))
+            return
+        except (urllib2.URLError, socket.error):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def client(args):
+    """Request URLs in turn until the duration ends.
+
+    Args:
+        args: Tuple of the list of URLs and the duration in seconds.
+
+    Returns:
+        Number of requests completed.
+    """
+    urls, duration = args
+    count = 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        urllib2.urlopen(urls[count % len(urls)]).read()
+        count += 1
+    return count
+
+
+def requests_per_second(port, blocks, clients, duration):
+    """Requests per second served to the concurrent clients."""
+    tasks = [(query_urls(port, blocks, 200, 'undirected', seed=x), duration)
+             for x in xrange(clients)]
+    pool = multiprocessing.Pool(clients)
+    try:
+        counts = pool.map(client, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    return sum(counts) / duration
+
+
+def main(side=200, worker_counts=(1, 2, 4), clients=8, duration=5):
+    directory = tempfile.mkdtemp()
+    try:
+        blocks_fname, interactions_fname = write_data(directory, side)
+        blocks = process.BlockIndex(process.load_blocks(
+            blocks_fname, os.path.join(directory, 'census-blocks.store')))
+        print 'blocks: {0}\tclients: {1}'.format(len(blocks), clients)
+        for processes in worker_counts:
+            port = unused_port()
+            server = multiprocessing.Process(
+                target=run_server,
+                args=(directory, blocks_fname, interactions_fname, port,
+                      processes))
+            server.start()
+            try:
+                wait_until_ready(port)
+                rate = requests_per_second(port, blocks, clients, duration)
+            finally:
+                os.killpg(server.pid, signal.SIGTERM)
+                server.join()
+            print 'processes: {0}\t{1:.0f} requests/sec'.format(processes,
+                                                                 rate)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Time every stage of the pipeline on synthetic data at several scales.
+
+For each scale, a bz2-archive of tweets and a census blocks archive are
+written to a temporary directory with `benchmarks.generators`, and then
+each stage is timed on them:
+
+- `filter`: `filter.combine_filter` of the tweet archive, in lines.
+- `extract`: `process.extract_data` of the filtered tweets, in
+  check-ins.
+- `interactions`: `process.compute_block_interactions` of the check-ins,
+  in check-ins.
+- `web`: `/api/interaction/blocks` requests for random census blocks,
+  which are answered by `web.InteractionApiHandler`, in requests.
+
+The data is the same on every run, so the results of two runs, such as
+before and after a change, can be compared. The results are printed as
+a table, and can be saved as JSON with `--output` and compared with
+the saved results of an earlier run with `--compare`.
+
+Run using the command: `python -m benchmarks.suite`
+"""
+from __future__ import division
+import argparse
+import bz2
+import collections
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from benchmarks.generators import (BOX, make_archive, make_box_blocks,
+                                   write_blocks)
+from benchmarks.web import mean_latency, query_urls, serve
+from inferhotspot import config
+from inferhotspot import filter as tweet_filter
+from inferhotspot import process
+from inferhotspot import web
+
+
+# The tweet archive has `users * checkins / geocoded_ratio` lines, and the
+# census blocks are a `side` by `side` grid covering the bounding box.
+SCALES = collections.OrderedDict([
+    ('small', dict(users=100, checkins=20, geocoded_ratio=0.1, side=30,
+                   requests=100)),
+    ('medium', dict(users=500, checkins=20, geocoded_ratio=0.1, side=100,
+                    requests=200)),
+    ('large', dict(users=2500, checkins=20, geocoded_ratio=0.1, side=300,
+                   requests=500)),
+])
+STAGES = ('filter', 'extract', 'interactions', 'web')
+
+
+@contextlib.contextmanager
+def quiet():
+    """Discard anything printed to stdout, such as progress messages."""
+    stdout = sys.stdout
+    with open(os.devnull, mode='w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def make_data(directory, users, checkins, geocoded_ratio, side, **_):
+    """Write the synthetic tweets and census blocks of a scale.
+
+    Args:
+        directory: String of the directory to write the files to.
+        users: Number of users making geocoded tweets.
+        checkins: Mean number of check-ins of each user.
+        geocoded_ratio: Float of the fraction of geocoded tweets.
+        side: Number of census blocks along each side of the grid.
+
+    Returns:
+        Dictionary of the paths of the `tweets` directory holding the
+        tweet archive and of the `blocks` archive, and the number of
+        `lines` of the tweet archive.
+    """
+    tweets = os.path.join(directory, 'tweets')
+    os.mkdir(tweets)
+    lines = int(round(users * checkins / geocoded_ratio))
+    make_archive(os.path.join(tweets, 'tweets.json.bz2'), lines,
+                 geocoded_ratio, users)
+    blocks = os.path.join(directory, 'census-blocks.tsv.bz2')
+    write_blocks(blocks, make_box_blocks(side))
+    return {'tweets': tweets, 'blocks': blocks, 'lines': lines}
+
+
+def run_filter(context):
+    """Filter the tweet archive.
+
+    Returns:
+        Tuple of the number of lines and the seconds taken.
+    """
+    output = os.path.join(context['directory'], 'filtered.json')
+    timer = timeit.default_timer
+    with quiet():
+        start = timer()
+        tweet_filter.combine_filter(context['tweets'], output,
+                                    [tweet_filter.FilterInBox(BOX)])
+        seconds = timer() - start
+    # `process.parse_archive` reads the filtered tweets from bz2.
+    context['filtered'] = output + '.bz2'
+    with open(output) as f:
+        with bz2.BZ2File(context['filtered'], mode='w') as archive:
+            shutil.copyfileobj(f, archive)
+    return context['lines'], seconds
+
+
+def run_extract(context):
+    """Extract the check-ins from the filtered tweets.
+
+    Returns:
+        Tuple of the number of check-ins and the seconds taken.
+    """
+    if 'filtered' not in context:
+        run_filter(context)
+    timer = timeit.default_timer
+    start = timer()
+    data = list(process.extract_data(
+        process.parse_archive(context['filtered'])))
+    seconds = timer() - start
+    context['data'] = data
+    return len(data), seconds
+
+
+def run_interactions(context):
+    """Count the census block interactions of the check-ins.
+
+    Returns:
+        Tuple of the number of check-ins and the seconds taken.
+    """
+    if 'data' not in context:
+        run_extract(context)
+    users = process.process_data(context['data'])[3]
+    # A new index for each run, so that no run reuses the prepared
+    # geometries of an earlier one.
+    store = os.path.join(context['directory'], 'census-blocks.store')
+    blocks = process.BlockIndex(process.load_blocks(context['blocks'],
+                                                    store))
+    timer = timeit.default_timer
+    start = timer()
+    interactions = process.compute_block_interactions(users, blocks)
+    seconds = timer() - start
+    context['blocks_index'] = blocks
+    context['interactions'] = interactions
+    return len(context['data']), seconds
+
+
+def run_web(context):
+    """Query the interactions of random blocks through the server.
+
+    Returns:
+        Tuple of the number of requests and the seconds taken.
+    """
+    if 'interactions' not in context:
+        run_interactions(context)
+    settings = config.create_default_config()
+    settings.set('web', 'debug', 'False')
+    blocks = context['blocks_index']
+    application = web.make_application(settings, blocks,
+                                       context['interactions'], (None, None))
+    port, stop = serve(application)
+    try:
+        # Only blocks with interactions are queried, like a user would.
+        sources = process.BlockIndex(dict(
+            (x, blocks[x]) for x in context['interactions']))
+        urls = query_urls(port, sources, context['requests'], 'undirected')
+        seconds = mean_latency(urls) * len(urls)
+    finally:
+        stop()
+        application.settings['query_executor'].shutdown()
+    return len(urls), seconds
+
+
+RUNNERS = {'filter': run_filter, 'extract': run_extract,
+           'interactions': run_interactions, 'web': run_web}
+
+
+def time_stage(stage, context, repeat):
+    """Best of several timings of a stage.
+
+    Only the work of the stage itself is timed. The results of earlier
+    stages that it needs are made first if they are not in the context.
+
+    Args:
+        stage: Name of the stage, one of `STAGES`.
+        context: Dictionary of the paths of the data, the scale
+            parameters, and the results of earlier stages, which is
+            updated with the results of this stage.
+        repeat: Number of times the stage is run.
+
+    Returns:
+        Tuple of the number of items and the least number of seconds.
+    """
+    timings = [RUNNERS[stage](context) for _ in xrange(repeat)]
+    return timings[0][0], min(seconds for _, seconds in timings)
+
+
+def git_revision():
+    """Commit ID of the working directory, or None if unknown."""
+    try:
+        with open(os.devnull, mode='w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(scales, stages, repeat=1):
+    """Time the stages at each scale.
+
+    Args:
+        scales: List of the names of scales in `SCALES`.
+        stages: List of the names of stages in `STAGES`.
+        repeat: Number of times each stage is run, of which the fastest
+            time is kept.
+
+    Yields:
+        Dictionary of the result of each stage at each scale.
+    """
+    for scale in scales:
+        directory = tempfile.mkdtemp()
+        try:
+            context = dict(SCALES[scale], directory=directory)
+            context.update(make_data(directory, **SCALES[scale]))
+            for stage in stages:
+                items, seconds = time_stage(stage, context, repeat)
+                yield {'stage': stage, 'scale': scale, 'items': items,
+                       'seconds': seconds,
+                       'items_per_second': items / seconds}
+        finally:
+            shutil.rmtree(directory)
+
+
+def main(scales=('small', 'medium'), stages=STAGES, repeat=1, output=None,
+         compare=None):
+    previous = dict()
+    if compare:
+        with open(compare) as f:
+            previous = dict(((x['stage'], x['scale']), x)
+                            for x in json.load(f)['results'])
+    row = '{0:<14}{1:<8}{2:>10}{3:>12}{4:>14}{5:>10}'
+    print row.format('stage', 'scale', 'items', 'seconds', 'items/sec',
+                     'speedup' if compare else '')
+    results = []
+    for result in run_suite(scales, stages, repeat):
+        results.append(result)
+        old = previous.get((result['stage'], result['scale']))
+        speedup = ''
+        if old:
+            speedup = '{0:.2f}x'.format(result['items_per_second'] /
+                                        old['items_per_second'])
+        print row.format(result['stage'], result['scale'], result['items'],
+                         '{0:.3f}'.format(result['seconds']),
+                         '{0:.0f}'.format(result['items_per_second']),
+                         speedup)
+    if output:
+        with open(output, mode='w') as f:
+            json.dump({'revision': git_revision(),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'cpus': multiprocessing.cpu_count(),
+                       'repeat': repeat,
+                       'scales': dict((x, SCALES[x]) for x in scales),
+                       'results': results}, f, indent=2, sort_keys=True)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='small,medium',
+                        help='comma separated scales to run, of: '
+                             '{0} (default: %(default)s)'.format(
+                                 ', '.join(SCALES)))
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='comma separated stages to time '
+                             '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='times to run each stage, keeping the '
+                             'fastest (default: %(default)s)')
+    parser.add_argument('--output', metavar='FILE',
+                        help='save the results to FILE as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='show the speedup over the JSON results '
+                             'saved in FILE by an earlier run')
+    args = parser.parse_args()
+    scales = args.scales.split(',')
+    stages = args.stages.split(',')
+    for name in scales:
+        if name not in SCALES:
+            parser.error('unknown scale: {0}'.format(name))
+    for name in stages:
+        if name not in STAGES:
+            parser.error('unknown stage: {0}'.format(name))
+    main(scales, [x for x in STAGES if x in stages], args.repeat,
+         args.output, args.compare)
@@ -0,0 +1,151 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Benchmark `plot.make_user_map` against one line object per user.
+
+Synthetic users with check-ins spread around their homes are drawn and
+saved as a PNG by both `plot.make_user_map` and `make_user_map_lines`,
+the earlier implementation that calls `ax.plot` once per user. Each
+rendering is run in a new worker process, so that the increase of its
+peak resident set size can be measured.
+
+Run using the command: `python -m benchmarks.user_map`
+"""
+from __future__ import division
+import cStringIO
+import multiprocessing
+import random
+import timeit
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from benchmarks.generators import BOX
+from inferhotspot import instrument
+from inferhotspot import plot
+
+
+def make_users(count, checkins=5, spread=0.02, box=BOX, seed=0):
+    """Create users with check-ins spread around a home point.
+
+    Args:
+        count: Number of users.
+        checkins: Mean number of check-ins per user.
+        spread: Float of the standard deviation of the distance of a
+            user's check-ins from their home, as a fraction of the size
+            of `box`.
+        box: Flat list of the bounding box, with the southwest corner
+            coming first.
+        seed: Seed for the random number generator.
+
+    Returns:
+        Tuple of the longitude and latitude lists of every check-in, and
+        a dictionary in the same form as the `users` of
+        `process.process_checkins`.
+    """
+    rand = random.Random(seed)
+    width, height = box[2] - box[0], box[3] - box[1]
+    users = dict()
+    for user in xrange(count):
+        home = (box[0] + rand.random() * width,
+                box[1] + rand.random() * height)
+        users[user] = [(rand.gauss(home[0], spread * width),
+                        rand.gauss(home[1], spread * height))
+                       for _ in xrange(rand.randint(1, 2 * checkins - 1))]
+    points = [point for user in users.itervalues() for point in user]
+    longitude, latitude = (list(x) for x in zip(*points))
+    return longitude, latitude, users
+
+
+def make_user_map_lines(longitude, latitude, users, box, place):
+    """The user map drawn with one `Line2D` per user, for comparison."""
+    figure = plt.figure('user-map')
+    figure.set_size_inches(12, 9, forward=True)
+    figure.set_dpi(100)
+
+    ax = figure.add_subplot(1, 1, 1)
+    ax.set_title("Users' Geocoded Tweets in {0}".format(place))
+    ax.set_xlabel('Longitude')
+    ax.set_ylabel('Latitude')
+    ax.grid(True)
+
+    plot.create_box(ax, box)
+
+    for user in users:
+        x, y = zip(*users[user])
+        line, = ax.plot(x,
+                        y,
+                        linewidth=1,
+                        marker='o',
+                        markersize=2)
+        line.set_alpha(0.2)
+
+    x, y = box[0], box[3]
+    y += (box[3] - box[1]) * .01
+    ax.text(x,
+            y,
+            'Unique users: {0}'.format(len(users)),
+            bbox=dict(facecolor='gray', alpha=0.25))
+
+    plot.ax_coord_bounds(ax, longitude, latitude, box)
+
+    figure.tight_layout(rect=(0.05, 0.05, 0.95, 0.95))
+
+    return figure
+
+
+MAKERS = {'collection': plot.make_user_map, 'lines': make_user_map_lines}
+
+
+def render(maker, count, max_users=None):
+    """Draw and save the user map of synthetic users.
+
+    Args:
+        maker: Key of `MAKERS` of the function drawing the map.
+        count: Number of users.
+        max_users: Maximum number of users drawn by `plot.make_user_map`.
+
+    Returns:
+        Tuple of the seconds taken to draw the figure and to save it,
+        and the increase of the peak resident set size in bytes.
+    """
+    longitude, latitude, users = make_users(count)
+    kwargs = {} if max_users is None else {'max_users': max_users}
+    baseline = instrument.peak_rss()
+    timer = timeit.default_timer
+    start = timer()
+    figure = MAKERS[maker](longitude, latitude, users, BOX, 'Denton',
+                           **kwargs)
+    drawn = timer()
+    figure.savefig(cStringIO.StringIO(), format='png', bbox_inches='tight',
+                   pad_inches=0.1)
+    saved = timer()
+    plt.close(figure)
+    return drawn - start, saved - drawn, instrument.peak_rss() - baseline
+
+
+def render_in_worker(*args):
+    """Call `render` in a new worker process."""
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(render, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(user_counts=(1000, 5000, 10000), max_users=2000):
+    print '{0:>8}  {1:<18}{2:>10}{3:>10}{4:>10}'.format(
+        'users', 'renderer', 'draw (s)', 'save (s)', 'RSS (MB)')
+    for count in user_counts:
+        runs = [('lines', None), ('collection', None)]
+        if max_users < count:
+            runs.append(('collection', max_users))
+        for maker, cap in runs:
+            draw, save, rss = render_in_worker(maker, count, cap)
+            name = maker if cap is None else '{0} ({1})'.format(maker, cap)
+            print '{0:>8}  {1:<18}{2:>10.2f}{3:>10.2f}{4:>10.1f}'.format(
+                count, name, draw, save, rss / 2 ** 20)
+
+
+if __name__ == '__main__':
+    main()
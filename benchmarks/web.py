@@ -0,0 +1,145 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Benchmark the interaction query latency of the web server.
+
+A server with synthetic census blocks and interactions is started on an
+unused port in a background thread, and the mean latency of directed and
+undirected `/api/interaction/blocks` requests is measured at several numbers
+of census blocks.
+
+Run using the command: `python -m benchmarks.web`
+"""
+from __future__ import division
+import random
+import threading
+import timeit
+import urllib
+import urllib2
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.testing
+
+from benchmarks.generators import make_blocks
+from inferhotspot import config
+from inferhotspot import process
+from inferhotspot import web
+
+
+def make_interactions(block_ids, targets=20, seed=0):
+    """Create random interactions between census blocks.
+
+    Args:
+        block_ids: List of census block IDs.
+        targets: Number of target blocks of each source block.
+        seed: Seed for the random number generator.
+
+    Returns:
+        Dictionary in the same form as `process.load_interactions`.
+    """
+    rand = random.Random(seed)
+    interactions = dict()
+    for source in block_ids:
+        interactions[source] = dict(
+            (target, rand.randint(1, 100))
+            for target in rand.sample(block_ids, min(targets,
+                                                     len(block_ids))))
+    return interactions
+
+
+def serve(application):
+    """Serve an application in a daemon thread.
+
+    Args:
+        application: The `tornado.web.Application` to serve.
+
+    Returns:
+        Tuple of the port number the application is served on, and a
+        function that stops the server.
+    """
+    sock, port = tornado.testing.bind_unused_port()
+    io_loop = tornado.ioloop.IOLoop()
+    ready = threading.Event()
+
+    def run():
+        io_loop.make_current()
+        server = tornado.httpserver.HTTPServer(application, xheaders=True)
+        server.add_sockets([sock])
+        io_loop.add_callback(ready.set)
+        io_loop.start()
+        server.stop()
+        io_loop.close()
+
+    def stop():
+        io_loop.add_callback(io_loop.stop)
+        thread.join()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    ready.wait()
+    return port, stop
+
+
+def make_server(side, targets=20):
+    """Serve the web application with a synthetic grid of blocks.
+
+    Args:
+        side: Number of blocks along each side of the grid.
+        targets: Number of target blocks of each source block.
+
+    Returns:
+        Tuple of the port number, a function that stops the server, and
+        the `process.BlockIndex`.
+    """
+    blocks = process.BlockIndex(make_blocks(side))
+    interactions = make_interactions(blocks.block_ids, targets)
+    settings = config.create_default_config()
+    settings.set('web', 'debug', 'False')
+    application = web.make_application(settings, blocks, interactions,
+                                       (None, None))
+    port, stop_server = serve(application)
+
+    def stop():
+        stop_server()
+        application.settings['query_executor'].shutdown()
+
+    return port, stop, blocks
+
+
+def query_urls(port, blocks, count, edges, seed=0):
+    """Create interaction query URLs at the centers of random blocks."""
+    rand = random.Random(seed)
+    urls = []
+    for _ in xrange(count):
+        center = blocks[rand.choice(blocks.block_ids)].centroid
+        query = urllib.urlencode({'latitude': center.y,
+                                  'longitude': center.x,
+                                  'edges': edges})
+        urls.append('http://127.0.0.1:{0}/api/interaction/blocks?{1}'.format(
+            port, query))
+    return urls
+
+
+def mean_latency(urls):
+    """Mean seconds to request each URL in turn."""
+    timer = timeit.default_timer
+    start = timer()
+    for url in urls:
+        urllib2.urlopen(url).read()
+    return (timer() - start) / len(urls)
+
+
+def main(sides=(10, 30, 100, 200), requests=100):
+    row = '{0:>8}  {1:>15}  {2:>17}'
+    print row.format('blocks', 'directed (ms)', 'undirected (ms)')
+    for side in sides:
+        port, stop, blocks = make_server(side)
+        latencies = [mean_latency(query_urls(port, blocks, requests, edges))
+                     for edges in ('directed', 'undirected')]
+        stop()
+        print row.format(len(blocks),
+                         *['{0:.2f}'.format(x * 1e3) for x in latencies])
+
+
+if __name__ == '__main__':
+    main()
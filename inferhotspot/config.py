@@ -38,6 +38,14 @@ def create_default_config():
     config.set('web', 'gzip', 'True')
     config.set('web', 'debug', 'True')
     config.set('web', 'web_query_log', 'web_log_queries.txt')
+    config.set('web', 'cache_size', '1024')
+    config.set('web', 'simplify_tolerance', '0')
+    config.set('web', 'processes', '1')
+    config.set('web', 'executor', 'thread')
+    config.set('web', 'executor_workers', '4')
+    config.set('web', 'max_pending', '64')
+    config.set('web', 'reload_interval', '5')
+    config.set('web', 'metrics_port', '0')
 
     return config
 
@@ -83,3 +91,25 @@ def get_config(fname=CONFIG_FNAME, create=True, exit=True):
             if not create:
                 return None
     return config
+
+
+def get_setting(config, section, option, getter='get'):
+    """Get a setting, falling back to the default value.
+
+    Configuration files created by an older version will not contain
+    settings that have been added since, so the value from
+    `create_default_config` is used for those.
+
+    Args:
+        config: An instance of ConfigParser.
+        section: String of the section name.
+        option: String of the option name.
+        getter: Name of the ConfigParser method used to get the value,
+            such as 'getint' or 'getboolean'. (Default: 'get')
+
+    Returns:
+        The value of the setting.
+    """
+    if not config.has_option(section, option):
+        config = create_default_config()
+    return getattr(config, getter)(section, option)
@@ -9,13 +9,30 @@ As an example, sometimes we want only those tweets that have a specific
 coordinates to be matches. However, the filter endpoint will try to use
 the region defined in the `place` field if the `coordinates` field is
 not populated, which will cause false positive matches.
+
+Decoding every tweet is the most expensive part of filtering, so a
+filter may also define a `precheck` method. It is given the raw JSON
+encoded line, and should return False only if the tweet certainly
+cannot match; such lines are then skipped without being decoded. The
+`ujson` package is used for decoding when it is installed.
 """
+import argparse
 import bz2
 import json
 import glob
+import itertools
+import multiprocessing
 import os
+import shutil
+import tempfile
 
 from config import get_config
+import instrument
+
+try:
+    import ujson as json_backend
+except ImportError:  # pragma: no cover
+    json_backend = json
 
 
 class FilterInBox(object):
@@ -51,6 +68,22 @@ class FilterInBox(object):
         return (self.box[0] < point[0] < self.box[2] and
                 self.box[1] < point[1] < self.box[3])
 
+    def precheck(self, line):
+        """Whether or not a raw tweet could be within the bounding box.
+
+        A populated coordinates field is always a GeoJSON Point, and the
+        bounding box of the `place` field is always a Polygon, so a line
+        that does not mention a Point cannot have coordinates.
+
+        Args:
+            line: String of the JSON encoded tweet.
+
+        Returns:
+            False if the tweet is certainly not within the bounding box,
+            otherwise True.
+        """
+        return '"Point"' in line
+
     def __call__(self, tweet):
         """Whether or not a tweet is within the bounding box.
 
@@ -71,7 +104,92 @@ class FilterInBox(object):
         return False
 
 
-def combine_filter(directory, output, filters, msginterval=10000):
+class FilterStatus(object):
+    """Running counts of the tweets processed by `combine_filter`.
+
+    Attributes:
+        count: Number of tweets that matched a filter.
+        total: Number of tweets that were processed, including every
+            line skipped by a precheck, whether or not it could have
+            been decoded.
+        errors: Number of lines that were decoded, because a precheck
+            did not skip them, and could not be. Lines skipped by a
+            precheck are never counted as errors.
+    """
+
+    def __init__(self, count=0, total=0, errors=0):
+        self.count = count
+        self.total = total
+        self.errors = errors
+
+    def __iadd__(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.errors += other.errors
+        return self
+
+    def __str__(self):
+        return 'count: {0}\ttotal: {1}\terrors: {2}'.format(self.count,
+                                                            self.total,
+                                                            self.errors)
+
+
+def filter_archive(fname, out, filters, status, msginterval=None):
+    """Write the tweets of one bz2 file that match a filter.
+
+    Args:
+        fname: The filename of the bz2-archive file.
+        out: File object to write the matching tweets to.
+        filters: Collection of callable objects, as in `combine_filter`.
+            If every filter has a `precheck` method, lines for which no
+            precheck returns True are counted in the `total` but not
+            decoded, so they are never counted as `errors`.
+        status: `FilterStatus` object to update while processing.
+        msginterval: Number of tweets to process between displaying
+            a status message to the user on stdout. (Default: None,
+            which never displays a message.)
+    """
+    prechecks = [getattr(check, 'precheck', None) for check in filters]
+    if not all(prechecks):
+        prechecks = None
+    with bz2.BZ2File(fname) as archive:
+        for line in archive:
+            line = line.rstrip()
+            if prechecks and not any(check(line) for check in prechecks):
+                status.total += 1
+            else:
+                try:
+                    tweet = json_backend.loads(line)
+                except ValueError:
+                    status.errors += 1
+                    continue
+                if any(check(tweet) for check in filters):
+                    status.count += 1
+                    out.write(line + '\n')
+                status.total += 1
+            if msginterval and status.total % msginterval == 0:
+                print status
+
+
+def _filter_shard(args):
+    """Filter one bz2 file to a temporary shard in a worker process.
+
+    Args:
+        args: Tuple of the bz2 filename, the directory in which to
+            create the shard, and the `filters`.
+
+    Returns:
+        Tuple of the shard filename and the `FilterStatus` of the file.
+    """
+    fname, directory, filters = args
+    status = FilterStatus()
+    fd, shard = tempfile.mkstemp(suffix='.shard', dir=directory)
+    with os.fdopen(fd, 'w') as out:
+        filter_archive(fname, out, filters, status)
+    return shard, status
+
+
+def combine_filter(directory, output, filters, msginterval=10000, workers=1):
     """Combine tweets that match a filter from bz2 files.
 
     Args:
@@ -83,38 +201,79 @@ def combine_filter(directory, output, filters, msginterval=10000):
             decoded tweet should return a boolean if the tweet matches
             the filter or not. The filters are evaluated using
             logical-OR, so if any filter matches the tweet is saved.
+            When using more than one worker the filters must be
+            picklable.
         msginterval: Number of tweets to process between displaying
             a status message to the user on stdout.
+        workers: Number of processes used to filter the bz2 files. When
+            greater than one, each file is filtered to a temporary shard
+            in a directory next to the `output`, which is removed even
+            if filtering fails, and the shards are concatenated in
+            sorted filename order, so the output is identical to the
+            single process output. The status message is then displayed
+            after each file. (Default: 1)
     """
-    status = 'count: {0}\ttotal: {1}\terrors: {2}'
-    count, total, errors = 0, 0, 0
-    with open(output, mode='w') as out:
-        pathname = os.path.join(directory, '*.bz2')
-        for fname in sorted(glob.glob(pathname)):
-            with bz2.BZ2File(fname) as archive:
+    pathname = os.path.join(directory, '*.bz2')
+    fnames = sorted(glob.glob(pathname))
+    status = FilterStatus()
+    with instrument.stage('filter') as timer:
+        if workers > 1:
+            _combine_parallel(fnames, output, filters, status, workers)
+        else:
+            with open(output, mode='w') as out:
+                for fname in fnames:
+                    print 'Processing:', fname
+                    filter_archive(fname, out, filters, status, msginterval)
+            if status.total % msginterval != 0:
+                print status
+        timer.add(status.total)
+    instrument.count('filter files', len(fnames))
+    instrument.count('filter matches', status.count)
+    instrument.count('filter errors', status.errors)
+
+
+def _combine_parallel(fnames, output, filters, status, workers):
+    """Filter bz2 files in a process pool and concatenate the shards."""
+    shard_dir = tempfile.mkdtemp(suffix='.shards',
+                                 dir=os.path.dirname(os.path.abspath(output)))
+    tasks = [(fname, shard_dir, filters) for fname in fnames]
+    pool = multiprocessing.Pool(workers)
+    results = pool.imap(_filter_shard, tasks)
+    try:
+        with open(output, mode='w') as out:
+            for fname, (shard, shard_status) in itertools.izip(fnames,
+                                                               results):
                 print 'Processing:', fname
-                for line in archive:
-                    line = line.rstrip()
-                    try:
-                        tweet = json.loads(line)
-                    except ValueError:
-                        errors += 1
-                        continue
-                    if any(check(tweet) for check in filters):
-                        count += 1
-                        out.write(line + '\n')
-                    total += 1
-                    if total % msginterval == 0:
-                        print status.format(count, total, errors)
-    if total % msginterval != 0:
-        print status.format(count, total, errors)
+                with open(shard) as f:
+                    shutil.copyfileobj(f, out)
+                os.remove(shard)
+                status += shard_status
+                print status
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        # Shards of files that were filtered after a worker failed.
+        shutil.rmtree(shard_dir, ignore_errors=True)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to filter the bz2 '
+                             'files (default: %(default)s)')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start(args)
+
     config = get_config()
     path = config.get('filter', 'process_directory')
     fname = config.get('filter', 'output')
     box = json.loads(config.get('place', 'box'))
 
     filters = [FilterInBox(box)]
-    combine_filter(directory=path, output=fname, filters=filters)
+    combine_filter(directory=path, output=fname, filters=filters,
+                   workers=args.workers)
+    instrument.finish(args)
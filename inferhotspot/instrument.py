@@ -0,0 +1,274 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Timers and counters for the stages of the batch pipeline.
+
+Each stage is timed with a context manager, which adds the wall time
+and CPU time spent inside it, and the number of items processed, to the
+totals of the stage. Instrumentation is off by default, in which case
+`stage` returns a shared object that does nothing, so the timers cost
+almost nothing unless `enable` has been called:
+
+    with instrument.stage('json decode') as timer:
+        tweets = [json.loads(line) for line in lines]
+        timer.add(len(lines))
+
+A stage can be entered many times, such as once per chunk of work, but
+must not be nested inside itself. Entering a stage costs a few
+microseconds, so a stage should time a chunk of items rather than each
+one. The CPU time and peak resident set size are of the current process
+only, so the work done by worker processes is counted in the wall time
+of the stage that waits for them.
+"""
+from __future__ import division
+import collections
+import cProfile
+import json
+import re
+import sys
+import time
+import timeit
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, but OS X reports bytes.
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class Stage(object):
+    """Totals of the time spent in a stage and the items it processed.
+
+    Attributes:
+        name: String of the name of the stage.
+        calls: Number of times the stage was entered.
+        items: Number of items processed, as added with `add`.
+        wall: Float of the total wall time in seconds.
+        cpu: Float of the total CPU time of the process in seconds.
+        peak_rss: Peak resident set size of the process in bytes when
+            the stage was last left, or None if unknown.
+        profiler: `cProfile.Profile` object enabled whenever the stage
+            is entered, or None to not profile the stage.
+    """
+
+    def __init__(self, name, profiler=None):
+        self.name = name
+        self.calls = 0
+        self.items = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss = None
+        self.profiler = profiler
+
+    def __enter__(self):
+        if self.profiler is not None:
+            self.profiler.enable()
+        self._cpu = time.clock()
+        self._wall = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall += timeit.default_timer() - self._wall
+        self.cpu += time.clock() - self._cpu
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.calls += 1
+        self.peak_rss = peak_rss()
+
+    def add(self, items=1):
+        """Count items processed by the stage."""
+        self.items += items
+
+    @property
+    def rate(self):
+        """Items per second of wall time, or None if not known."""
+        if not self.items or not self.wall:
+            return None
+        return self.items / self.wall
+
+    def to_dict(self):
+        """Dictionary of the totals, suitable for JSON encoding."""
+        return {'name': self.name, 'calls': self.calls, 'items': self.items,
+                'wall': self.wall, 'cpu': self.cpu,
+                'peak_rss': self.peak_rss, 'items_per_second': self.rate}
+
+
+class _NullStage(object):
+    """Stage that records nothing, used while not instrumenting."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def add(self, items=1):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Recorder(object):
+    """Totals of the stages and counters of a run.
+
+    Attributes:
+        stages: Ordered dictionary of stage name to `Stage`, in the
+            order the stages were first entered.
+        counters: Ordered dictionary of counter name to count.
+        profile: String of the name of the stage to profile, or None.
+    """
+
+    def __init__(self, profile=None):
+        """Creates a new recorder.
+
+        Args:
+            profile: String of the name of a stage to profile with
+                cProfile whenever it is entered. (Default: None)
+        """
+        self.stages = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.profile = profile
+
+    def stage(self, name):
+        """The `Stage` of a name, which is created the first time."""
+        stage = self.stages.get(name)
+        if stage is None:
+            profiler = cProfile.Profile() if name == self.profile else None
+            stage = self.stages[name] = Stage(name, profiler)
+        return stage
+
+    def count(self, name, value=1):
+        """Add to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        """Dictionary of the stages and counters, for JSON encoding."""
+        return {'stages': [x.to_dict() for x in self.stages.itervalues()],
+                'counters': self.counters,
+                'peak_rss': peak_rss()}
+
+    def report(self):
+        """String of a table of the stages, followed by the counters."""
+        row = '{0:<24}{1:>8}{2:>11}{3:>10}{4:>10}{5:>12}{6:>10}'
+        lines = [row.format('stage', 'calls', 'items', 'wall (s)',
+                            'cpu (s)', 'items/sec', 'RSS (MB)')]
+        for stage in self.stages.itervalues():
+            lines.append(row.format(
+                stage.name[:23], stage.calls, stage.items or '',
+                '{0:.3f}'.format(stage.wall), '{0:.3f}'.format(stage.cpu),
+                '{0:.0f}'.format(stage.rate) if stage.rate else '',
+                '{0:.0f}'.format(stage.peak_rss / 2 ** 20)
+                if stage.peak_rss else ''))
+        for name, value in self.counters.iteritems():
+            lines.append('{0}: {1}'.format(name, value))
+        return '\n'.join(lines)
+
+    def save_json(self, fname):
+        """Save the stages and counters to a JSON file."""
+        with open(fname, mode='w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def save_profile(self, fname=None):
+        """Save the statistics of the profiled stage.
+
+        Args:
+            fname: String of the path of the file, which can be read with
+                the `pstats` module. (Default: the stage name, with
+                anything but letters and digits replaced by hyphens, and
+                `.prof` added.)
+
+        Returns:
+            The filename, or None if the profiled stage was not entered.
+        """
+        stage = self.stages.get(self.profile)
+        if stage is None:
+            return None
+        if fname is None:
+            fname = re.sub(r'[^A-Za-z0-9]+', '-', self.profile) + '.prof'
+        stage.profiler.dump_stats(fname)
+        return fname
+
+
+_recorder = None
+
+
+def enable(profile=None):
+    """Start recording the stages and counters of the pipeline.
+
+    Args:
+        profile: String of the name of a stage to profile, as for
+            `Recorder`. (Default: None)
+
+    Returns:
+        The new `Recorder`.
+    """
+    global _recorder
+    _recorder = Recorder(profile)
+    return _recorder
+
+
+def disable():
+    """Stop recording, and return the `Recorder`, or None."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def stage(name):
+    """The `Stage` of a name, or one that does nothing if disabled."""
+    if _recorder is None:
+        return _NULL_STAGE
+    return _recorder.stage(name)
+
+
+def count(name, value=1):
+    """Add to a counter, if recording."""
+    if _recorder is not None:
+        _recorder.count(name, value)
+
+
+def add_arguments(parser):
+    """Add the command line options of the instrumentation to a parser.
+
+    Args:
+        parser: The `argparse.ArgumentParser` of a script.
+    """
+    parser.add_argument('--stats', action='store_true',
+                        help='report the time, memory, and items per '
+                             'second of each stage')
+    parser.add_argument('--stats-json', metavar='FILE',
+                        help='save the stage statistics to FILE as JSON')
+    parser.add_argument('--profile', metavar='STAGE',
+                        help='profile the named stage with cProfile and '
+                             'save the statistics to a .prof file named '
+                             'after it')
+
+
+def start(args):
+    """Enable recording if the options of `add_arguments` ask for it."""
+    if args.stats or args.stats_json or args.profile:
+        enable(args.profile)
+
+
+def finish(args):
+    """Report and save the statistics as asked by the options."""
+    recorder = disable()
+    if recorder is None:
+        return
+    if args.stats:
+        print recorder.report()
+    if args.stats_json:
+        recorder.save_json(args.stats_json)
+    if args.profile:
+        fname = recorder.save_profile()
+        if fname is None:
+            print 'The stage to profile was not run:', args.profile
+        else:
+            print 'Saved profile:', fname
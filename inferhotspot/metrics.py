@@ -0,0 +1,212 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Counters and histograms exposed in the Prometheus text format.
+
+Only what the web server needs is implemented: counters, histograms with
+fixed buckets, and values read from a function when they are exposed.
+Every metric may have labels, whose values are given in the order of the
+label names. The metrics are not locked, so they should only be updated
+from a single thread, such as the IOLoop of the web server.
+
+See: https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+import bisect
+import timeit
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds of the buckets of a latency histogram.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    """Escape a label value for the text format."""
+    return (unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(names, values):
+    """String of the labels of a sample, such as `{code="200"}`."""
+    if not names:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, _escape(value))
+                          for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    """String of a sample value, using the text format's infinity."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """Count of events that only goes up.
+
+    Attributes:
+        name: String of the metric name.
+        help: String describing the metric.
+        labels: Tuple of the label names.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = dict()
+
+    def inc(self, *values, **kwargs):
+        """Add to the count of some label values.
+
+        Args:
+            values: The label values, in the order of `labels`.
+            amount: Number to add. (Default: 1)
+        """
+        self._values[values] = (self._values.get(values, 0) +
+                                kwargs.get('amount', 1))
+
+    def get(self, *values):
+        """Count of some label values."""
+        return self._values.get(values, 0)
+
+    def samples(self):
+        """Yields (name, label names, label values, value) of each sample."""
+        for values in sorted(self._values):
+            yield self.name, self.labels, values, self._values[values]
+
+
+class Histogram(object):
+    """Distribution of observed values in fixed buckets.
+
+    Attributes:
+        name: String of the metric name.
+        help: String describing the metric.
+        labels: Tuple of the label names.
+        buckets: Tuple of the increasing upper bounds of the buckets.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Label values to a list of the count of each bucket, with one
+        # more for values above the last bucket, followed by the sum.
+        self._values = dict()
+
+    def observe(self, value, *values):
+        """Add a value to the distribution of some label values."""
+        counts = self._values.get(values)
+        if counts is None:
+            counts = self._values[values] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *values):
+        """Context manager that observes the seconds spent inside it."""
+        return _Timer(self, values)
+
+    def count(self, *values):
+        """Number of values observed for some label values."""
+        counts = self._values.get(values)
+        return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        """Yields (name, label names, label values, value) of each sample.
+
+        The `le` label of each bucket is added after the other labels.
+        """
+        bucket_labels = self.labels + ('le',)
+        for values in sorted(self._values):
+            counts = self._values[values]
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),),
+                                    counts[:-1]):
+                total += count
+                yield (self.name + '_bucket', bucket_labels,
+                       values + (_format_value(bound),), total)
+            yield self.name + '_sum', self.labels, values, counts[-1]
+            yield self.name + '_count', self.labels, values, total
+
+
+class _Timer(object):
+    """Observes the seconds spent inside a `with` statement."""
+
+    def __init__(self, histogram, values):
+        self._histogram = histogram
+        self._values = values
+
+    def __enter__(self):
+        self._start = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(timeit.default_timer() - self._start,
+                                *self._values)
+
+
+class Callback(object):
+    """Metric whose value is read from a function when it is exposed.
+
+    Attributes:
+        name: String of the metric name.
+        help: String describing the metric.
+        kind: String of the metric type, either 'counter' or 'gauge'.
+    """
+
+    def __init__(self, name, help, kind, function):
+        """Creates a new metric.
+
+        Args:
+            name: String of the metric name.
+            help: String describing the metric.
+            kind: String of the metric type, 'counter' or 'gauge'.
+            function: Callable with no arguments that returns the value.
+        """
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self._function = function
+
+    def samples(self):
+        """Yields (name, label names, label values, value) of each sample."""
+        yield self.name, (), (), self._function()
+
+
+class Registry(object):
+    """Collection of metrics exposed together."""
+
+    def __init__(self, labels=()):
+        """Creates a new registry.
+
+        Args:
+            labels: Pairs of a label name and value added before the
+                labels of every sample, such as to identify the process.
+                (Default: no labels)
+        """
+        self._metrics = []
+        self._labels = tuple(name for name, _ in labels)
+        self._values = tuple(value for _, value in labels)
+
+    def add(self, metric):
+        """Add a metric to the registry, and return it."""
+        self._metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        """String of every metric in the Prometheus text format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.kind))
+            for name, names, values, value in metric.samples():
+                lines.append(u'{0}{1} {2}'.format(
+                    name, _format_labels(self._labels + names,
+                                         self._values + tuple(values)),
+                    _format_value(value)))
+        return u'\n'.join(lines) + u'\n'
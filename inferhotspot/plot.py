@@ -1,15 +1,23 @@
 # Copyright (C) 2013 Wesley Baugh
 """Visually display geocded tweets."""
+import argparse
 import json
+import multiprocessing
 import os
+import random
+import timeit
 
 import matplotlib.pyplot as plt
-from matplotlib.colors import LogNorm
+import numpy
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LogNorm, to_rgba_array
 from matplotlib.patches import Rectangle
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
 from config import get_config
+import instrument
 import process
+import stream
 
 
 def create_box(ax, box):
@@ -114,9 +122,15 @@ def make_map(longitude, latitude, time, box, place):
     return figure
 
 
-def make_user_map(longitude, latitude, users, box, place):
+def make_user_map(longitude, latitude, users, box, place, max_users=None,
+                  seed=0):
     """Plot lines for each user using geocoded tweets.
 
+    The lines of every user are drawn by a single `LineCollection`, and
+    the check-ins by a single scatter plot, so that the time and memory
+    taken do not depend on the number of users as much as one line
+    object per user would. Each user has a color of the color cycle.
+
     Args:
         longitude: List of longitude float values of length *N*.
         latitude: List of latitude float values of length *N*.
@@ -126,6 +140,10 @@ def make_user_map(longitude, latitude, users, box, place):
         box = A pair of longitude and latitude pairs, with the southwest
             corner of the bounding box coming first.
         place = String for the place name of the bounding `box`.
+        max_users: Maximum number of users drawn, which are a random
+            sample of the users if there are more. (Default: None, which
+            draws every user.)
+        seed: Seed for the random sample of users.
 
     Returns:
         Figure object used to create the plot.
@@ -142,21 +160,41 @@ def make_user_map(longitude, latitude, users, box, place):
 
     create_box(ax, box)
 
-    for user in users:
-        x, y = zip(*users[user])
-        line, = ax.plot(x,
-                        y,
-                        linewidth=1,
-                        marker='o',
-                        markersize=2)
-        line.set_alpha(0.2)
+    drawn = sorted(users)
+    if max_users is not None and len(drawn) > max_users:
+        drawn = sorted(random.Random(seed).sample(drawn, max_users))
+    points = numpy.array([point for user in drawn for point in users[user]],
+                         dtype=float).reshape(-1, 2)
+    # Index of the user of each point, and of each pair of consecutive
+    # points of the same user, which are the ends of a line segment.
+    user_index = numpy.repeat(numpy.arange(len(drawn)),
+                              [len(users[user]) for user in drawn])
+    same_user = user_index[1:] == user_index[:-1]
+    segments = numpy.stack([points[:-1][same_user], points[1:][same_user]],
+                           axis=1)
+    colors = to_rgba_array(plt.rcParams['axes.prop_cycle'].by_key()['color'],
+                           alpha=0.2)
+
+    lines = LineCollection(segments,
+                           linewidths=1,
+                           colors=colors[user_index[:-1][same_user] %
+                                         len(colors)])
+    ax.add_collection(lines)
+    ax.scatter(x=points[:, 0],
+               y=points[:, 1],
+               s=4,
+               c=colors[user_index % len(colors)],
+               marker='o')
 
     # Display number of unique users.
     x, y = box[0], box[3]  # top-left of box.
     y += (box[3] - box[1]) * .01  # add a little margin
+    text = 'Unique users: {0}'.format(len(users))
+    if len(drawn) < len(users):
+        text += ' ({0} drawn)'.format(len(drawn))
     ax.text(x,
             y,
-            'Unique users: {0}'.format(len(users)),
+            text,
             bbox=dict(facecolor='gray', alpha=0.25))
 
     ax_coord_bounds(ax, longitude, latitude, box)
@@ -174,6 +212,22 @@ def make_user_checkins(users):
             containing the ordered list of longitude-latitude points
             that are associated with that user.
 
+    Returns:
+        Figure object used for the histogram.
+    """
+    user_checkins = []
+    for user in users:
+        user_checkins.append(len(users[user]))
+
+    return make_user_checkin_counts(user_checkins)
+
+
+def make_user_checkin_counts(user_checkins):
+    """Plot a histogram of check-ins per user from the counts.
+
+    Args:
+        user_checkins: List of the number of check-ins of each user.
+
     Returns:
         Figure object used for the histogram.
     """
@@ -187,10 +241,6 @@ def make_user_checkins(users):
     ax.set_yscale('log')
     ax.grid(True)
 
-    user_checkins = []
-    for user in users:
-        user_checkins.append(len(users[user]))
-
     n, bins, patches = ax.hist(user_checkins, bins=100)
 
     return figure
@@ -241,11 +291,106 @@ def make_heatmap(longitude, latitude, box, place):
     return figure
 
 
-def make_time(time):
+def make_heatmap_grid(heatmap, edges, sample, box, place):
+    """Plot a 2D histogram of geocoded tweets as a heat map.
+
+    Args:
+        heatmap: 2D array of tweet counts, indexed by the longitude bin
+            and then the latitude bin.
+        edges: Pair of the longitude and latitude bin edges.
+        sample: Pair of lists of the longitude and latitude float values
+            of a sample of the tweets, used to set the axes bounds.
+        box = A pair of longitude and latitude pairs, with the southwest
+            corner of the bounding box coming first.
+        place = String for the place name of the bounding `box`.
+
+    Returns:
+        Figure object used to create the heat map.
+    """
+    figure = plt.figure('heatmap')
+    figure.set_size_inches(12, 9, forward=True)
+    figure.set_dpi(100)
+
+    ax = figure.add_subplot(1, 1, 1)
+    ax.set_title('Geocoded Tweets in {0}'.format(place))
+    ax.set_xlabel('Longitude')
+    ax.set_ylabel('Latitude')
+    ax.grid(True)
+
+    create_box(ax, box)
+
+    heatmap = ax.pcolormesh(edges[0],
+                            edges[1],
+                            numpy.ma.masked_less(heatmap.T, 1),
+                            norm=LogNorm(),
+                            cmap=plt.cm.rainbow)
+
+    colorbar = create_colorbar(ax, heatmap, cmap=plt.cm.rainbow)
+    colorbar.set_label('Number of Tweets')
+
+    ax_coord_bounds(ax, sample[0], sample[1], box)
+
+    figure.tight_layout(rect=(0.05, 0.05, 0.95, 0.95))
+
+    return figure
+
+
+def make_movement_map(movements, sample, unique_users, box, place):
+    """Plot a line for each movement between two check-ins of a user.
+
+    Args:
+        movements: Array of rows of the source longitude, source
+            latitude, target longitude, and target latitude.
+        sample: Pair of lists of the longitude and latitude float values
+            of a sample of the tweets, used to set the axes bounds.
+        unique_users: Number of unique users.
+        box = A pair of longitude and latitude pairs, with the southwest
+            corner of the bounding box coming first.
+        place = String for the place name of the bounding `box`.
+
+    Returns:
+        Figure object used to create the plot.
+    """
+    figure = plt.figure('user-map')
+    figure.set_size_inches(12, 9, forward=True)
+    figure.set_dpi(100)
+
+    ax = figure.add_subplot(1, 1, 1)
+    ax.set_title("Users' Geocoded Tweets in {0}".format(place))
+    ax.set_xlabel('Longitude')
+    ax.set_ylabel('Latitude')
+    ax.grid(True)
+
+    create_box(ax, box)
+
+    segments = numpy.asarray(movements).reshape(-1, 2, 2)
+    lines = LineCollection(segments, linewidths=1, alpha=0.2)
+    lines.set_array(numpy.arange(len(segments)) % 10)
+    lines.set_cmap(plt.cm.Paired)
+    ax.add_collection(lines)
+
+    # Display number of unique users.
+    x, y = box[0], box[3]  # top-left of box.
+    y += (box[3] - box[1]) * .01  # add a little margin
+    ax.text(x,
+            y,
+            'Unique users: {0}'.format(unique_users),
+            bbox=dict(facecolor='gray', alpha=0.25))
+
+    ax_coord_bounds(ax, sample[0], sample[1], box)
+
+    figure.tight_layout(rect=(0.05, 0.05, 0.95, 0.95))
+
+    return figure
+
+
+def make_time(time, weights=None):
     """Plot a histogram of time of day values.
 
     Args:
         time: List of time of day float values length *N*.
+        weights: List of the number of tweets of each `time` value of
+            length *N*. (Default: None, which counts each value once.)
 
     Returns:
         Figure object used for the histogram.
@@ -260,70 +405,312 @@ def make_time(time):
     ax.set_xlim(0, 24)
     ax.grid(True)
 
-    n, bins, patches = ax.hist(time, bins=range(25))
+    n, bins, patches = ax.hist(time, bins=range(25), weights=weights)
 
     return figure
 
 
-def make_plots(tweets, box, place):
+def make_plots(checkins, box, place, workers=1, max_users=None,
+               figure_workers=1, show=True, fmt='png', dpi=None):
     """Make plots from the extracted tweet data.
 
     Args:
-        tweets: Iterable of tweets already filtered and within the
-            bounding box.
+        checkins: NumPy array of check-ins from tweets already filtered
+            and within the bounding box, as returned by
+            `process.load_checkins`.
         box = A pair of longitude and latitude pairs, with the southwest
             corner of the bounding box coming first.
         place = String for the place name of the bounding `box`.
+        workers: Number of processes used to compute the census block
+            interactions. (Default: 1)
+        max_users: Maximum number of users drawn on the user map, as
+            used by `make_user_map`. (Default: None, which draws every
+            user.)
+        figure_workers: Number of processes used to draw the figures,
+            as used by `render_figures`. (Default: 1)
+        show: Boolean whether to show the figures once they are saved,
+            which is only done if they were drawn by this process.
+        fmt: String of the file format of the figures. (Default: 'png')
+        dpi: Dots per inch of the saved figures. (Default: None, which
+            uses the resolution of each figure.)
     """
-    print 'Extracting tweets ...',
-    data = list(process.extract_data(tweets))
+    blocks = load_census_blocks()
+
+    print 'Processing data ...',
+    with instrument.stage('process check-ins') as timer:
+        longitude, latitude, time, users = process.process_checkins(
+            checkins)
+        timer.add(len(checkins))
+    instrument.count('check-ins', len(checkins))
+    instrument.count('users', len(users))
     print 'DONE'
 
-    print 'Extracting census blocks ...',
-    census_path = config.get('census', 'path')
-    census_blocks = config.get('census', 'blocks')
-    blocks = process.extract_blocks(os.path.join(census_path, census_blocks))
+    print 'Computing census block interactions ...',
+    interactions_by_time = process.count_checkin_interactions(
+        longitude, latitude, checkins['user_id'], blocks, workers,
+        checkins['created_at'])
     print 'DONE'
 
-    print 'Processing data ...',
-    longitude, latitude, time, users = process.process_data(data)
+    save_interactions(process.total_interactions(interactions_by_time),
+                      interactions_by_time)
+
+    figures = render_figures(
+        [('map', make_map, (longitude, latitude, time, box, place)),
+         ('user-map', make_user_map,
+          (longitude, latitude, users, box, place, max_users)),
+         ('user-checkins', make_user_checkins, (users,)),
+         ('heatmap', make_heatmap, (longitude, latitude, box, place)),
+         ('time', make_time, (time,))],
+        figure_workers, fmt, dpi)
+
+    if show and figures:
+        plt.show()
+
+
+def make_stream_plots(chunks, box, place, sample_size=100000,
+                      figure_workers=1, show=True, fmt='png', dpi=None):
+    """Make plots from check-ins in a single, bounded memory pass.
+
+    The scatter map and user map are drawn from a random sample of the
+    check-ins and of the movements between check-ins, and the heat map
+    is drawn as a rectangular 2D histogram.
+
+    Args:
+        chunks: Iterable of check-in arrays of tweets already filtered
+            and within the bounding box, such as from `stream.iter_chunks`.
+        box = A pair of longitude and latitude pairs, with the southwest
+            corner of the bounding box coming first.
+        place = String for the place name of the bounding `box`.
+        sample_size: Maximum number of check-ins and movements drawn on
+            the maps.
+        figure_workers, show, fmt, dpi: How the figures are drawn and
+            saved, as used by `make_plots`.
+    """
+    blocks = load_census_blocks()
+
+    print 'Aggregating tweets ...',
+    stats = stream.CheckinStats(box, blocks, sample_size=sample_size)
+    for chunk in chunks:
+        with instrument.stage('aggregate check-ins') as timer:
+            stats.add(chunk)
+            timer.add(len(chunk))
+    instrument.count('check-ins', sum(stats.user_checkins.itervalues()))
+    instrument.count('users', len(stats.user_checkins))
     print 'DONE'
 
-    print 'Computing census block interactions ...',
-    interactions = process.compute_block_interactions(users, blocks)
+    save_interactions(stats.interactions, stats.interactions_by_time)
+
+    longitude, latitude, time = stats.sample.rows.T
+    sample = longitude, latitude
+    figures = render_figures(
+        [('map', make_map, (longitude, latitude, time, box, place)),
+         ('user-map', make_movement_map,
+          (stats.movements.rows, sample, len(stats.user_checkins), box,
+           place)),
+         ('user-checkins', make_user_checkin_counts,
+          (stats.user_checkins.values(),)),
+         ('heatmap', make_heatmap_grid,
+          (stats.heatmap, stats.heatmap_edges, sample, box, place)),
+         ('time', make_time, (range(24), stats.hours))],
+        figure_workers, fmt, dpi)
+
+    if show and figures:
+        plt.show()
+
+
+# Figures drawn by `_render_figure`. They are set before the worker
+# processes are forked, so the workers inherit the arrays they are drawn
+# from instead of having them pickled.
+_figure_makers = None
+
+
+def _render_figure(index):
+    """Draw and save one of the `_figure_makers` in a worker process.
+
+    Returns:
+        Tuple of the figure label and the seconds taken.
+    """
+    # The workers only save the figures, so they do not need a display.
+    plt.switch_backend('Agg')
+    label, function, args, fmt, dpi = _figure_makers[index]
+    start = timeit.default_timer()
+    figure = function(*args)
+    save_figure(figure, fmt, dpi)
+    plt.close(figure)
+    return label, timeit.default_timer() - start
+
+
+def render_figures(makers, workers=1, fmt='png', dpi=None):
+    """Draw figures and save them to the working directory.
+
+    With several workers, each figure is drawn and saved by a pool of
+    processes that share the arguments of the figures with the current
+    process, so that the figures are drawn at the same time. They are
+    then closed instead of being returned to be shown.
+
+    Args:
+        makers: List of tuples of the label of a figure, the function
+            that draws it, and a tuple of the function's arguments.
+        workers: Number of worker processes. (Default: 1, which draws
+            the figures in the current process.)
+        fmt: String of the file format, such as 'png', 'pdf', or 'svg'.
+            (Default: 'png')
+        dpi: Dots per inch of the saved figures. (Default: None, which
+            uses the resolution of each figure.)
+
+    Returns:
+        List of the figures drawn in the current process, which is empty
+        if they were drawn by worker processes.
+    """
+    global _figure_makers
+    if workers <= 1:
+        print 'Making figures ...',
+        figures = []
+        for label, function, args in makers:
+            with instrument.stage('figure {0}'.format(label)):
+                figures.append(function(*args))
+        print 'DONE'
+        save_figures(figures, fmt, dpi)
+        return figures
+
+    print 'Making and saving figures ...',
+    _figure_makers = [(label, function, args, fmt, dpi)
+                      for label, function, args in makers]
+    pool = multiprocessing.Pool(min(workers, len(makers)))
+    try:
+        with instrument.stage('figures') as timer:
+            seconds = pool.map(_render_figure, range(len(makers)),
+                               chunksize=1)
+            timer.add(len(makers))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _figure_makers = None
+    for label, value in seconds:
+        instrument.count('figure {0} seconds'.format(label), value)
     print 'DONE'
+    return []
 
-    print 'Saving census block interactions ...',
-    with open('census-block-interactions.tsv', mode='w') as f:
-        process.dump_interactions(interactions, f)
+
+def load_census_blocks():
+    """Load the census blocks of the configuration file.
+
+    Returns:
+        A `process.BlockIndex` of the census blocks.
+    """
+    print 'Extracting census blocks ...',
+    with instrument.stage('census blocks load') as timer:
+        census_path = config.get('census', 'path')
+        census_blocks = config.get('census', 'blocks')
+        blocks = process.load_blocks(os.path.join(census_path,
+                                                  census_blocks))
+        blocks = process.BlockIndex(blocks)
+        timer.add(len(blocks))
     print 'DONE'
+    return blocks
+
+
+def save_interactions(interactions, interactions_by_time):
+    """Save the census block interactions to the working directory.
 
-    print 'Making figures ...',
-    figures = []
-    figures.append(make_map(longitude, latitude, time, box, place))
-    figures.append(make_user_map(longitude, latitude, users, box, place))
-    figures.append(make_user_checkins(users))
-    figures.append(make_heatmap(longitude, latitude, box, place))
-    figures.append(make_time(time))
+    Args:
+        interactions: Dictionary of block IDs with a dictionary that
+            stores how many times the source block interacted with the
+            target block.
+        interactions_by_time: Dictionary of the same interactions
+            counted by time, as from `process.count_interactions`.
+    """
+    print 'Saving census block interactions ...',
+    with instrument.stage('interactions save') as timer:
+        with open('census-block-interactions.tsv', mode='w') as f:
+            process.dump_interactions(interactions, f)
+        with open('census-block-interactions-by-time.tsv', mode='w') as f:
+            process.dump_interactions(interactions_by_time, f)
+        timer.add(len(interactions))
     print 'DONE'
 
+
+def save_figure(figure, fmt='png', dpi=None):
+    """Save a figure to a file named after the figure label.
+
+    Args:
+        figure: The figure to save.
+        fmt: String of the file format, such as 'png', 'pdf', or 'svg',
+            which is also the file extension. (Default: 'png')
+        dpi: Dots per inch of the saved figure. (Default: None, which
+            uses the resolution of the figure.)
+    """
+    figure.savefig('{0}.{1}'.format(figure.get_label(), fmt),
+                   format=fmt,
+                   dpi=dpi,
+                   bbox_inches='tight',
+                   pad_inches=0.1)
+
+
+def save_figures(figures, fmt='png', dpi=None):
+    """Save each figure to a file named after the figure label."""
     print 'Saving figures ...',
     for figure in figures:
-        figure.savefig('{0}.png'.format(figure.get_label()),
-                       bbox_inches='tight',
-                       pad_inches=0.1)
+        with instrument.stage('savefig {0}'.format(figure.get_label())):
+            save_figure(figure, fmt, dpi)
     print 'DONE'
 
-    plt.show()
-
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stream', action='store_true',
+                        help='aggregate the tweets in a single pass with '
+                             'bounded memory, sampling the maps')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to compute the '
+                             'census block interactions, except with '
+                             '--stream (default: %(default)s)')
+    parser.add_argument('--max-users', type=int, metavar='N',
+                        help='draw a random sample of N users on the user '
+                             'map, except with --stream (default: every '
+                             'user)')
+    parser.add_argument('--figure-workers', type=int, default=1,
+                        metavar='N',
+                        help='number of processes used to draw and save '
+                             'the figures at the same time, which implies '
+                             '--headless (default: %(default)s)')
+    parser.add_argument('--headless', action='store_true',
+                        help='save the figures without a display, and do '
+                             'not show them')
+    parser.add_argument('--format', default='png',
+                        help='file format of the figures, such as png, '
+                             'pdf, or svg (default: %(default)s)')
+    parser.add_argument('--dpi', type=float,
+                        help='dots per inch of the saved figures (default: '
+                             'the resolution of each figure)')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start(args)
+    show = not args.headless and args.figure_workers <= 1
+    if not show:
+        plt.switch_backend('Agg')
+    output = dict(figure_workers=args.figure_workers, show=show,
+                  fmt=args.format, dpi=args.dpi)
+
     config = get_config()
     path = config.get('plot', 'path')
     fname = config.get('plot', 'archive')
     box = json.loads(config.get('place', 'box'))
     place = config.get('place', 'name')
 
-    tweets = process.parse_archive(os.path.join(path, fname))
-
-    make_plots(tweets, box, place)
+    if args.stream:
+        tweets = process.parse_archive(os.path.join(path, fname))
+        chunks = stream.iter_chunks(process.extract_data(tweets))
+        make_stream_plots(chunks, box, place, **output)
+    else:
+        print 'Loading tweets ...',
+        with instrument.stage('check-ins load'):
+            checkins = process.load_checkins(os.path.join(path, fname))
+        print 'DONE'
+
+        make_plots(checkins, box, place, args.workers, args.max_users,
+                   **output)
+    instrument.finish(args)
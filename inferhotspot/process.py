@@ -2,17 +2,45 @@
 """Functions to extract and process Twitter data."""
 from __future__ import division
 import bz2
+import calendar
 import collections
-import dateutil
+import contextlib
+import datetime
 import itertools
 import json
+import math
+import multiprocessing
+import os
+import threading
 
+import dateutil.parser
+import dateutil.tz
+import numpy
+import shapely.geometry
+import shapely.prepared
+import shapely.vectorized
 import shapely.wkb
 
+import instrument
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+# Number of bytes of lines read from an archive at a time.
+READ_SIZE = 2 ** 14
+# Number of tweets whose created-at times are parsed at a time.
+EXTRACT_SIZE = 1000
+
 
 def parse_archive(path):
     """Get tweets from a bz2 archive.
 
+    The lines are read and decoded in chunks, which are timed as the
+    `archive read` and `json decode` stages of `instrument`.
+
     Args:
         path: String of the path for the file.
 
@@ -20,18 +48,81 @@ def parse_archive(path):
         Dictionary representing a tweet, decoded from a JSON string.
     """
     with bz2.BZ2File(path) as archive:
-        for line in archive:
-            line = line.rstrip()
-            try:
-                tweet = json.loads(line)
-            except ValueError:
-                continue
-            yield tweet
+        while True:
+            with instrument.stage('archive read') as timer:
+                lines = archive.readlines(READ_SIZE)
+                timer.add(len(lines))
+            if not lines:
+                break
+            with instrument.stage('json decode') as timer:
+                tweets = []
+                for line in lines:
+                    try:
+                        tweets.append(json.loads(line))
+                    except ValueError:
+                        instrument.count('json decode errors')
+                timer.add(len(lines))
+            for tweet in tweets:
+                yield tweet
+
+
+MONTHS = dict((month, number) for number, month in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], start=1))
+UTC = dateutil.tz.tzutc()
+# Positions of the spaces and colons before the UTC offset.
+SEPARATORS = (3, 7, 10, 13, 16)
+_created_at_cache = dict()
+
+
+def parse_created_at(created_at, max_cache=100000):
+    """Parse the created-at time of a tweet.
+
+    Twitter always uses the same format, so it is parsed by position
+    rather than with the much slower `dateutil.parser.parse`, which is
+    only used for times that do not have the expected format. Many
+    tweets share the same second, so parsed times are also cached.
+
+    Args:
+        created_at: String of the created-at field of a tweet, such as
+            'Tue Feb 12 06:33:37 +0000 2013'.
+        max_cache: Number of parsed times to cache before the cache is
+            cleared, or 0 to not cache the result. (Default: 100000)
+
+    Returns:
+        A timezone aware `datetime.datetime` object, equal to the one
+        returned by `dateutil.parser.parse`.
+    """
+    try:
+        return _created_at_cache[created_at]
+    except KeyError:
+        pass
+    try:
+        if (len(created_at) != 30 or created_at[19:26] != ' +0000 ' or
+                ''.join(created_at[x] for x in SEPARATORS) != '   ::'):
+            raise ValueError(created_at)
+        parsed = datetime.datetime(int(created_at[26:30]),
+                                   MONTHS[created_at[4:7]],
+                                   int(created_at[8:10]),
+                                   int(created_at[11:13]),
+                                   int(created_at[14:16]),
+                                   int(created_at[17:19]),
+                                   tzinfo=UTC)
+    except (KeyError, ValueError):
+        parsed = dateutil.parser.parse(created_at)
+    if max_cache:
+        if len(_created_at_cache) >= max_cache:
+            _created_at_cache.clear()
+        _created_at_cache[created_at] = parsed
+    return parsed
 
 
 def extract_data(tweets):
     """Extract data to plot from tweets.
 
+    The created-at times are parsed in chunks of `EXTRACT_SIZE` tweets,
+    which are timed as the `date parse` stage of `instrument`.
+
     Args:
         tweets: An iterable containing JSON decoded tweets.
 
@@ -45,17 +136,24 @@ def extract_data(tweets):
         The datetime object yielded would be:
             datetime.datetime(2013, 2, 12, 6, 33, 37, tzinfo=tzutc())
     """
-    for tweet in tweets:
-        # Coordinates
-        point = tweet['coordinates']['coordinates']
-        longitude = point[0]
-        latitude = point[1]
+    tweets = iter(tweets)
+    while True:
+        chunk = list(itertools.islice(tweets, EXTRACT_SIZE))
+        if not chunk:
+            break
         # Created-at time
-        created_at = tweet['created_at']
-        created_at = dateutil.parser.parse(created_at)
-        # User ID
-        user_id = tweet['user']['id']
-        yield longitude, latitude, created_at, user_id
+        with instrument.stage('date parse') as timer:
+            times = [parse_created_at(tweet['created_at'])
+                     for tweet in chunk]
+            timer.add(len(chunk))
+        for tweet, created_at in itertools.izip(chunk, times):
+            # Coordinates
+            point = tweet['coordinates']['coordinates']
+            longitude = point[0]
+            latitude = point[1]
+            # User ID
+            user_id = tweet['user']['id']
+            yield longitude, latitude, created_at, user_id
 
 
 def process_data(data):
@@ -80,8 +178,190 @@ def process_data(data):
     return longitude, latitude, time, users
 
 
+def process_checkins(checkins):
+    """Process a check-in array and extract additional features.
+
+    This is the same as `process_data`, but for the structured array
+    returned by `load_checkins`.
+
+    Args:
+        checkins: NumPy array with the `CHECKIN_DTYPE` fields.
+
+    Retruns:
+        Tuple: longitude, latitude, time, users.
+    """
+    longitude = checkins['longitude']
+    latitude = checkins['latitude']
+    seconds = checkins['created_at']
+    time = (seconds % 86400 // 3600) + (seconds % 3600 // 60 / 60)
+    # Combine all points from same user, keeping the check-in order.
+    order = numpy.argsort(checkins['user_id'], kind='mergesort')
+    user_id = checkins['user_id'][order]
+    boundaries = numpy.flatnonzero(user_id[1:] != user_id[:-1]) + 1
+    users = dict()
+    for indices in numpy.split(order, boundaries):
+        if len(indices):
+            user = int(checkins['user_id'][indices[0]])
+            users[user] = zip(longitude[indices].tolist(),
+                              latitude[indices].tolist())
+    return longitude, latitude, time, users
+
+
+CHECKIN_DTYPE = numpy.dtype([('longitude', '<f8'),
+                             ('latitude', '<f8'),
+                             ('created_at', '<i8'),
+                             ('user_id', '<i8')])
+
+
+def checkins_cache_fname(path):
+    """Filename of the check-in cache for a bz2 archive of tweets.
+
+    The cache is saved to the current working directory.
+    """
+    return os.path.basename(path) + '.checkins.npy'
+
+
+def _archive_key(path):
+    """Size and modification time identifying a version of a file."""
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def build_checkins(path, cache=None):
+    """Extract the check-ins of a bz2 archive to a columnar cache file.
+
+    The cache is a NumPy `.npy` file of a structured array with the
+    `CHECKIN_DTYPE` fields, with the created-at time stored as seconds
+    since the epoch. The size and modification time of the archive are
+    saved in a JSON file next to it, named by adding `.json` to the
+    cache filename.
+
+    Args:
+        path: String of the path of the bz2 archive of tweets.
+        cache: String of the path of the cache file. (Default: from
+            `checkins_cache_fname`.)
+
+    Returns:
+        The cache filename.
+    """
+    if cache is None:
+        cache = checkins_cache_fname(path)
+    key = _archive_key(path)
+    checkins = []
+    for longitude, latitude, created_at, user_id in extract_data(
+            parse_archive(path)):
+        created_at = calendar.timegm(created_at.utctimetuple())
+        checkins.append((longitude, latitude, created_at, user_id))
+    checkins = numpy.array(checkins, dtype=CHECKIN_DTYPE)
+    with open(cache + '.tmp', mode='wb') as f:
+        numpy.save(f, checkins)
+    os.rename(cache + '.tmp', cache)
+    _save_key(cache, key)
+    return cache
+
+
+def load_checkins(path, cache=None):
+    """Load the check-ins of a bz2 archive, using the columnar cache.
+
+    The cache is built first with `build_checkins` if it does not exist
+    or if the archive has changed since it was built. The cache is then
+    memory-mapped, so loading it takes almost no time.
+
+    Args:
+        path: String of the path of the bz2 archive of tweets.
+        cache: String of the path of the cache file. (Default: from
+            `checkins_cache_fname`.)
+
+    Returns:
+        A read-only NumPy array with the `CHECKIN_DTYPE` fields, with
+        one element per tweet in the order of the archive.
+    """
+    if cache is None:
+        cache = checkins_cache_fname(path)
+    if not _is_fresh(path, cache):
+        build_checkins(path, cache)
+    return numpy.load(cache, mmap_mode='r')
+
+
+def _save_array(fname, array):
+    """Save an array to a `.npy` file, replacing any existing file.
+
+    The array is written to a temporary file that is then renamed, so a
+    process that has memory-mapped the old file keeps its data intact.
+    """
+    tmp = '{0}.{1}.tmp'.format(fname, os.getpid())
+    with open(tmp, mode='wb') as f:
+        numpy.save(f, array)
+    os.rename(tmp, fname)
+
+
+def _save_key(cache, key):
+    """Save the key of the file a cache was built from.
+
+    The key is written to a temporary file that is then renamed, so
+    that `_is_fresh` never reads a partly written key.
+    """
+    fname = cache + '.json'
+    tmp = '{0}.{1}.tmp'.format(fname, os.getpid())
+    with open(tmp, mode='w') as f:
+        json.dump(key, f)
+    os.rename(tmp, fname)
+
+
+@contextlib.contextmanager
+def _build_lock(cache):
+    """Lock building a cache against other processes.
+
+    The lock is held on a file named by adding `.lock` to the cache
+    path, so that processes needing the same cache at once, such as the
+    forked web servers, wait for the first one to build it. Nothing is
+    locked where the `fcntl` module is not available.
+    """
+    if fcntl is None:  # pragma: no cover
+        yield
+        return
+    with open(cache + '.lock', mode='a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _is_fresh(path, cache):
+    """Whether a cache was built from the current version of a file.
+
+    Args:
+        path: String of the path of the source file.
+        cache: String of the path of the cache, whose key is saved in a
+            JSON file named by adding `.json` to the cache path.
+
+    Returns:
+        Boolean whether the cache exists and the source file has the
+        same size and modification time as when the cache was built.
+    """
+    try:
+        with open(cache + '.json') as f:
+            fresh = json.load(f) == _archive_key(path)
+    except (IOError, ValueError):
+        fresh = False
+    return fresh and os.path.exists(cache)
+
+
+def _iter_blocks(fname):
+    """Yields the block ID and geometry of each line of a block archive.
+
+    Each line of the uncompressed archive has a census block ID and the
+    hex encoded WKB of its geometry, separated by a tab.
+    """
+    with bz2.BZ2File(fname) as archive:
+        for line in archive:
+            block_id, geometry = line.rstrip().split('\t')
+            yield block_id, shapely.wkb.loads(geometry.decode('hex'))
+
+
 def extract_blocks(fname):
-    """Get tweets from a bz2 archive.
+    """Get census blocks from a bz2 archive.
 
     Args:
         fname: String of the full path the archive.
@@ -90,13 +370,409 @@ def extract_blocks(fname):
         Dictionary of census block geometry objects with census block ID
         as the key.
     """
-    blocks = dict()
-    with bz2.BZ2File(fname) as archive:
-        for line in archive:
-            block_id, geometry = line.rstrip().split('\t')
-            geometry = shapely.wkb.loads(geometry.decode('hex'))
-            blocks[block_id] = geometry
-    return blocks
+    return dict(_iter_blocks(fname))
+
+
+class BlockStore(collections.Mapping):
+    """Memory-mapped census block geometry compiled by `compile_blocks`.
+
+    The coordinates of every block are held in flat NumPy arrays, with
+    offset arrays marking where each block, polygon, and ring starts.
+    Opening a store takes almost no time, and a shapely geometry object
+    is only created the first time the block is accessed. The store may
+    be used from several threads, which create each object only once.
+
+    The store is a read-only mapping of block ID to geometry object, so
+    it can be used anywhere the dictionary from `extract_blocks` is
+    used.
+
+    Attributes:
+        block_ids: Sorted NumPy string array of the census block IDs.
+        bounds: NumPy array with a row of (min_x, min_y, max_x, max_y)
+            for each block, ordered as `block_ids`.
+    """
+
+    ARRAYS = ('block_ids', 'bounds', 'block_offsets', 'polygon_offsets',
+              'ring_offsets', 'coords')
+
+    def __init__(self, path):
+        """Opens a compiled store.
+
+        Args:
+            path: String of the path of the directory of the store.
+        """
+        for name in self.ARRAYS:
+            array = numpy.load(os.path.join(path, name + '.npy'),
+                               mmap_mode='r')
+            setattr(self, name, array)
+        self._geometries = dict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, block_id):
+        try:
+            return self._geometries[block_id]
+        except KeyError:
+            pass
+        position = int(numpy.searchsorted(self.block_ids, block_id))
+        if (position >= len(self.block_ids) or
+                self.block_ids[position] != block_id):
+            raise KeyError(block_id)
+        with self._lock:
+            geometry = self._geometries.get(block_id)
+            if geometry is None:
+                geometry = self._geometries[block_id] = self._geometry(
+                    position)
+        return geometry
+
+    def __iter__(self):
+        return iter(self.block_ids.tolist())
+
+    def __len__(self):
+        return len(self.block_ids)
+
+    def __contains__(self, block_id):
+        position = int(numpy.searchsorted(self.block_ids, block_id))
+        return (position < len(self.block_ids) and
+                self.block_ids[position] == block_id)
+
+    def _geometry(self, position):
+        """Create the MultiPolygon of the block at a position."""
+        polygons = []
+        for polygon in xrange(self.block_offsets[position],
+                              self.block_offsets[position + 1]):
+            rings = [self.coords[self.ring_offsets[ring]:
+                                 self.ring_offsets[ring + 1]]
+                     for ring in xrange(self.polygon_offsets[polygon],
+                                        self.polygon_offsets[polygon + 1])]
+            polygons.append((rings[0], rings[1:]))
+        return shapely.geometry.MultiPolygon(polygons)
+
+
+def compile_blocks(fname, store):
+    """Compile a census block archive into a `BlockStore`.
+
+    Args:
+        fname: String of the full path of the archive, in the format
+            read by `extract_blocks`.
+        store: String of the path of the directory to save the store
+            to, which is created if it does not exist.
+    """
+    block_ids, bounds, coords = [], [], []
+    block_offsets, polygon_offsets, ring_offsets = [0], [0], [0]
+    vertices = 0
+    for block_id, geometry in _iter_blocks(fname):
+        polygons = getattr(geometry, 'geoms', [geometry])
+        block_ids.append(block_id)
+        bounds.append(geometry.bounds)
+        for polygon in polygons:
+            for ring in [polygon.exterior] + list(polygon.interiors):
+                ring = numpy.asarray(ring.coords)[:, :2]
+                coords.append(ring)
+                vertices += len(ring)
+                ring_offsets.append(vertices)
+            polygon_offsets.append(len(ring_offsets) - 1)
+        block_offsets.append(len(polygon_offsets) - 1)
+
+    # Reorder the blocks by ID, keeping each block's polygons together.
+    order = sorted(xrange(len(block_ids)), key=block_ids.__getitem__)
+    arrays = dict(block_ids=numpy.array([block_ids[x] for x in order],
+                                        dtype=str),
+                  bounds=numpy.array([bounds[x] for x in order],
+                                     dtype=float).reshape(-1, 4))
+    new_blocks, new_polygons, new_rings, new_coords = [0], [0], [0], []
+    for position in order:
+        for polygon in xrange(block_offsets[position],
+                              block_offsets[position + 1]):
+            for ring in xrange(polygon_offsets[polygon],
+                               polygon_offsets[polygon + 1]):
+                new_coords.append(coords[ring])
+                new_rings.append(new_rings[-1] + len(coords[ring]))
+            new_polygons.append(len(new_rings) - 1)
+        new_blocks.append(len(new_polygons) - 1)
+    arrays['block_offsets'] = numpy.array(new_blocks, dtype=numpy.int64)
+    arrays['polygon_offsets'] = numpy.array(new_polygons, dtype=numpy.int64)
+    arrays['ring_offsets'] = numpy.array(new_rings, dtype=numpy.int64)
+    if new_coords:
+        arrays['coords'] = numpy.concatenate(new_coords)
+    else:
+        arrays['coords'] = numpy.empty((0, 2))
+
+    if not os.path.isdir(store):
+        os.makedirs(store)
+    for name in BlockStore.ARRAYS:
+        _save_array(os.path.join(store, name + '.npy'), arrays[name])
+
+
+def load_blocks(fname, store=None):
+    """Open the census blocks of an archive as a `BlockStore`.
+
+    The store is compiled from the archive the first time, and again
+    whenever the archive changes.
+
+    Args:
+        fname: String of the full path of the archive, in the format
+            read by `extract_blocks`.
+        store: String of the path of the store directory. (Default: the
+            archive's filename with `.store` added, in the current
+            working directory.)
+
+    Returns:
+        A `BlockStore` of the census blocks.
+    """
+    if store is None:
+        store = os.path.basename(fname) + '.store'
+    if not _is_fresh(fname, store):
+        with _build_lock(store):
+            # Another process may have compiled it while we waited.
+            if not _is_fresh(fname, store):
+                key = _archive_key(fname)
+                compile_blocks(fname, store)
+                _save_key(store, key)
+    return BlockStore(store)
+
+
+class BlockIndex(collections.Mapping):
+    """Spatial index over census block geometry objects.
+
+    The bounding box of every block is registered in each cell of a
+    uniform grid that it overlaps. Finding the block that holds a point
+    only needs to test the few blocks registered in the point's cell
+    instead of every block. `find` first compares the point with the
+    bounds of each of those blocks, and only tests the blocks whose
+    bounds hold it with their prepared geometries.
+
+    The index may be used from several threads, such as those of a
+    `web.QueryExecutor`. GEOS aborts the process if a prepared geometry
+    builds its internal index in two threads at once, so each prepared
+    geometry is created and its index built under a lock, before it is
+    shared with the other threads.
+
+    The index is also a read-only mapping of block ID to geometry, so it
+    can be used anywhere the dictionary from `extract_blocks` is used.
+
+    Attributes:
+        block_ids: List of the census block IDs, in sorted order.
+        bounds: NumPy float array with a row of the minimum longitude,
+            minimum latitude, maximum longitude, and maximum latitude of
+            each block, in the order of `block_ids`.
+        cell_size: Float of the width and height of each grid cell.
+    """
+
+    def __init__(self, blocks, cell_size=None):
+        """Creates a new spatial index.
+
+        Args:
+            blocks: Dictionary of census block geometry objects with
+                census block ID as the key, as returned by
+                `extract_blocks`, or a `BlockStore`. The geometry of a
+                block in a `BlockStore` is only accessed when a point
+                falls within its bounding box.
+            cell_size: Float of the width and height of each grid cell
+                in degrees. (Default: the mean extent of the blocks.)
+        """
+        self._blocks = blocks
+        self.block_ids = sorted(blocks)
+        self._prepared = dict()
+        self._lock = threading.Lock()
+        if isinstance(blocks, BlockStore):
+            bounds = blocks.bounds.tolist()
+        else:
+            bounds = [blocks[x].bounds for x in self.block_ids]
+        self.bounds = numpy.array(bounds, dtype=float).reshape(-1, 4)
+        # Tuples are faster than the array to compare single points with.
+        self._bounds = [tuple(b) for b in bounds]
+        if cell_size is None:
+            extents = [max(b[2] - b[0], b[3] - b[1]) for b in bounds]
+            cell_size = sum(extents) / len(extents) if extents else 1.0
+        self.cell_size = cell_size or 1.0
+        self._grid = collections.defaultdict(list)
+        for position, (min_x, min_y, max_x, max_y) in enumerate(bounds):
+            min_col, min_row = self._cell(min_x, min_y)
+            max_col, max_row = self._cell(max_x, max_y)
+            for col in xrange(min_col, max_col + 1):
+                for row in xrange(min_row, max_row + 1):
+                    self._grid[col, row].append(position)
+        self._grid = dict(self._grid)
+
+    def __getitem__(self, block_id):
+        return self._blocks[block_id]
+
+    def __iter__(self):
+        return iter(self.block_ids)
+
+    def __len__(self):
+        return len(self.block_ids)
+
+    def _prepare(self, position):
+        """Prepared geometry of the block at a position in `block_ids`."""
+        prepared = self._prepared.get(position)
+        if prepared is not None:
+            return prepared
+        with self._lock:
+            prepared = self._prepared.get(position)
+            if prepared is None:
+                geometry = self._blocks[self.block_ids[position]]
+                prepared = shapely.prepared.prep(geometry)
+                # The first predicate builds the index of the prepared
+                # geometry, which is then only read by the others.
+                min_x, min_y = self._bounds[position][:2]
+                prepared.contains(shapely.geometry.Point(min_x, min_y))
+                self._prepared[position] = prepared
+        return prepared
+
+    def _cell(self, x, y):
+        """Grid cell (column, row) that holds the coordinate.
+
+        Returns None if the coordinate is not finite, such as NaN, since
+        no cell can hold it.
+        """
+        col, row = x / self.cell_size, y / self.cell_size
+        if (math.isinf(col) or math.isnan(col) or
+                math.isinf(row) or math.isnan(row)):
+            return None
+        return int(math.floor(col)), int(math.floor(row))
+
+    def find(self, point):
+        """Find the census block ID that holds the given point.
+
+        Args:
+            point: A shapely.geometry.Point object.
+
+        Returns:
+            The block ID that contains the point, otherwise None, which
+            is also returned for a point that is not finite.
+        """
+        x, y = point.x, point.y
+        for position in self._grid.get(self._cell(x, y), ()):
+            min_x, min_y, max_x, max_y = self._bounds[position]
+            if (min_x <= x <= max_x and min_y <= y <= max_y and
+                    self._prepare(position).contains(point)):
+                return self.block_ids[position]
+        return None
+
+    def assign(self, longitude, latitude):
+        """Find the census block that holds each of many points.
+
+        Duplicate coordinates are only looked up once. The remaining
+        points are grouped by grid cell, and each candidate block of a
+        cell is tested against all of the cell's points at once.
+
+        Args:
+            longitude: Sequence of longitude float values of length *N*.
+            latitude: Sequence of latitude float values of length *N*.
+
+        Returns:
+            NumPy integer array of length *N* with the position in
+            `block_ids` of the block that contains each point, or -1 if
+            no block contains the point.
+        """
+        longitude = numpy.asarray(longitude, dtype=float)
+        latitude = numpy.asarray(latitude, dtype=float)
+        points, inverse = numpy.unique(longitude + 1j * latitude,
+                                       return_inverse=True)
+        if not len(points):
+            return numpy.empty(0, dtype=int)
+        x, y = points.real, points.imag
+        cols = numpy.floor(x / self.cell_size).astype(int)
+        rows = numpy.floor(y / self.cell_size).astype(int)
+        order = numpy.lexsort((rows, cols))
+        cols, rows = cols[order], rows[order]
+        boundaries = numpy.flatnonzero((cols[1:] != cols[:-1]) |
+                                       (rows[1:] != rows[:-1])) + 1
+        starts = numpy.concatenate(([0], boundaries))
+        ends = numpy.concatenate((boundaries, [len(order)]))
+
+        positions = numpy.empty(len(points), dtype=int)
+        positions.fill(-1)
+        for start, end in itertools.izip(starts, ends):
+            cell = int(cols[start]), int(rows[start])
+            candidates = self._grid.get(cell)
+            if not candidates:
+                continue
+            remaining = order[start:end]
+            for position in candidates:
+                found = shapely.vectorized.contains(self._prepare(position),
+                                                    x[remaining],
+                                                    y[remaining])
+                positions[remaining[found]] = position
+                remaining = remaining[~found]
+                if not len(remaining):
+                    break
+        return positions[inverse]
+
+
+def encode_polyline(coords):
+    """Encode coordinates with Google's encoded polyline algorithm.
+
+    See: https://developers.google.com/maps/documentation/utilities/
+    polylinealgorithm
+
+    Args:
+        coords: Iterable of longitude and latitude pairs.
+
+    Returns:
+        String of the encoded polyline, which contains only printable
+        ASCII characters.
+    """
+    chars = []
+    prev_lat, prev_lng = 0, 0
+    for longitude, latitude in coords:
+        lat = int(round(latitude * 1e5))
+        lng = int(round(longitude * 1e5))
+        for value in (lat - prev_lat, lng - prev_lng):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                chars.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chars.append(chr(value + 63))
+        prev_lat, prev_lng = lat, lng
+    return ''.join(chars)
+
+
+class EncodedBlocks(collections.Mapping):
+    """Outlines of the census blocks encoded for Google Maps.
+
+    Only the exterior of the first polygon of each block is encoded.
+    Each outline is encoded the first time it is accessed, and then
+    kept, so that blocks that are never rendered are never encoded. The
+    outlines may be accessed from several threads, which encode each
+    outline only once.
+    """
+
+    def __init__(self, blocks, tolerance=0):
+        """Creates a new mapping of encoded outlines.
+
+        Args:
+            blocks: Mapping of census block IDs to geometry objects,
+                such as a `BlockIndex`.
+            tolerance: Float of the distance in degrees within which the
+                outline is simplified, or 0 to not simplify. (Default: 0)
+        """
+        self._blocks = blocks
+        self.tolerance = tolerance
+        self._paths = dict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, block_id):
+        path = self._paths.get(block_id)
+        if path is not None:
+            return path
+        with self._lock:
+            path = self._paths.get(block_id)
+            if path is None:
+                exterior = self._blocks[block_id].geoms[0].exterior
+                if self.tolerance:
+                    exterior = exterior.simplify(self.tolerance,
+                                                 preserve_topology=True)
+                path = self._paths[block_id] = encode_polyline(
+                    exterior.coords)
+        return path
+
+    def __iter__(self):
+        return iter(self._blocks)
+
+    def __len__(self):
+        return len(self._blocks)
 
 
 def bigrams(iterable):
@@ -123,61 +799,338 @@ def point_to_block(point, blocks):
 
     Args:
         point: A shapely.geometry.Point object.
-        blocks: A dictionary of block IDs mapping to the associated
-            shapely geometry object representing the censsu block.
+        blocks: A `BlockIndex` of the census blocks. A dictionary of
+            block IDs mapping to the associated shapely geometry object
+            representing the census block is also accepted, but every
+            block is then tested in turn.
 
     Returns:
         The block ID that contains the point, otherwise None.
     """
+    if isinstance(blocks, BlockIndex):
+        return blocks.find(point)
     for block in blocks:
         if blocks[block].contains(point):
             return block
     return None
 
 
-def compute_block_interactions(users, blocks):
-    """Compute census block interactions using Twitter data.
+# Number of time buckets that interactions are counted in: one for each
+# hour of each day of the week.
+TIME_BUCKETS = 7 * 24
+
+
+def time_bucket(seconds):
+    """Time bucket of a time, numbered from Monday 00:00 UTC by hour.
+
+    Args:
+        seconds: Integer, or NumPy integer array, of seconds since the
+            epoch, such as the `created_at` field of `CHECKIN_DTYPE`.
+
+    Returns:
+        The weekday (Monday is 0) times 24 plus the hour of day, in UTC.
+    """
+    # The epoch was a Thursday.
+    return (seconds // 86400 + 3) % 7 * 24 + seconds % 86400 // 3600
+
+
+def time_buckets(hour_from=0, hour_to=24, weekdays=None):
+    """Time buckets of a range of hours on some days of the week.
+
+    Args:
+        hour_from: First hour of day (UTC) of the range. (Default: 0)
+        hour_to: Hour of day (UTC) at which the range ends, which wraps
+            around midnight if it is not after `hour_from`.
+            (Default: 24)
+        weekdays: Collection of the weekdays on which the range starts,
+            where Monday is 0. The hours of a range that wraps around
+            midnight which are after midnight are on the next day, so
+            that (22, 2, [4]) is from Friday 22:00 to Saturday 02:00.
+            (Default: None, which uses every day.)
+
+    Returns:
+        Sorted list of the buckets, as numbered by `time_bucket`.
+    """
+    if hour_from < hour_to:
+        hours = range(hour_from, hour_to)
+    else:
+        hours = range(hour_from, 24) + range(24, 24 + hour_to % 24)
+    if weekdays is None:
+        weekdays = range(7)
+    # Hours after midnight are numbered from 24, and the bucket of the
+    # last day of the week wraps to the first.
+    return sorted(set((day * 24 + hour) % (7 * 24)
+                      for day in weekdays for hour in hours))
+
+
+def _count_pairs(positions, user_ids, size, buckets=None):
+    """Count the consecutive block pairs of each user's check-ins.
 
     Args:
-        users:
-        blocks: Dictionary of census block geometry objects with census
-        block ID as the key.
+        positions: Integer array of block positions for each check-in,
+            as returned by `BlockIndex.assign`.
+        user_ids: Array of the user ID for each check-in, grouped by
+            user, with each user's check-ins in the order they were
+            made.
+        size: Number of blocks in the `BlockIndex`.
+        buckets: Integer array of the `time_bucket` of each check-in, or
+            None to not count by time. A pair is counted in the bucket
+            of its target check-in.
+
+    Returns:
+        Tuple of the sorted unique pairs, encoded as the source position
+        times `size` plus the target position, and their counts. When
+        counting by time, each pair is also multiplied by `TIME_BUCKETS`
+        and the bucket added.
+    """
+    source, target = positions[:-1], positions[1:]
+    valid = ((user_ids[1:] == user_ids[:-1]) & (source >= 0) & (target >= 0))
+    pairs = source[valid] * size + target[valid]
+    if buckets is not None:
+        pairs = pairs * TIME_BUCKETS + buckets[1:][valid]
+    return numpy.unique(pairs, return_counts=True)
+
+
+def _pairs_to_interactions(pairs, counts, blocks, by_time=False):
+    """Dictionary of interactions from the output of `_count_pairs`."""
+    if by_time:
+        interactions = collections.defaultdict(
+            lambda: collections.defaultdict(dict))
+    else:
+        interactions = collections.defaultdict(collections.Counter)
+    for pair, count in itertools.izip(pairs.tolist(), counts.tolist()):
+        if by_time:
+            pair, bucket = divmod(pair, TIME_BUCKETS)
+        source, target = divmod(pair, len(blocks))
+        source, target = blocks.block_ids[source], blocks.block_ids[target]
+        if by_time:
+            interactions[source][target][bucket] = count
+        else:
+            interactions[source][target] = count
+    if by_time:
+        return dict((source, dict(targets))
+                    for source, targets in interactions.iteritems())
+    return dict(interactions)
+
+
+def count_interactions(positions, user_ids, blocks, created_at=None):
+    """Count census block interactions from block-assigned check-ins.
+
+    Args:
+        positions: Integer array of block positions for each check-in,
+            as returned by `BlockIndex.assign`, in the order the
+            check-ins were made.
+        user_ids: Array of the user ID for each check-in.
+        blocks: The `BlockIndex` used to assign the `positions`.
+        created_at: Integer array of the seconds since the epoch of each
+            check-in, to count the interactions by time. (Default: None)
+
+    Returns:
+        Dictionary of block IDs with a dictionary that stores how many
+        times the source block interacted with the target block. When
+        counting by time, each count is instead a dictionary of the
+        `time_bucket` of the target check-in with the count.
+    """
+    positions = numpy.asarray(positions)
+    user_ids = numpy.asarray(user_ids)
+    # Keep each user's check-ins in their original order.
+    order = numpy.argsort(user_ids, kind='mergesort')
+    buckets = None
+    if created_at is not None:
+        buckets = time_bucket(numpy.asarray(created_at)[order])
+    pairs, counts = _count_pairs(positions[order], user_ids[order],
+                                 len(blocks), buckets)
+    return _pairs_to_interactions(pairs, counts, blocks,
+                                  created_at is not None)
+
+
+def total_interactions(interactions):
+    """Sum the time buckets of interactions counted by time.
+
+    Args:
+        interactions: Dictionary of interactions counted by time, as
+            returned by `count_interactions`.
 
     Returns:
         Dictionary of block IDs with a dictionary that stores how many
         times the source block interacted with the target block.
     """
-    interactions = collections.defaultdict(collections.Counter)
-
-    for index, user in enumerate(users, start=1):
-        cache = dict()
-        for bigram in bigrams(users[user]):
-            source, target = bigram
-            source_long, source_lat = source
-            target_long, target_lat = target
-
-            if source in cache:
-                source = cache[source]
-            else:
-                block = source
-                source = shapely.geometry.Point(source_long, source_lat)
-                source = point_to_block(source, blocks)
-                cache[block] = source
-
-            if target in cache:
-                target = cache[target]
-            else:
-                block = target
-                target = shapely.geometry.Point(target_long, target_lat)
-                target = point_to_block(target, blocks)
-                cache[block] = target
-
-            if source is None or target is None:
-                continue
+    return dict((source, dict((target, sum(buckets.itervalues()))
+                              for target, buckets in targets.iteritems()))
+                for source, targets in interactions.iteritems())
 
-            interactions[source][target] += 1
 
-    return dict(interactions)
+# Check-ins and blocks of the shards handled by `_assign_shard` and
+# `_count_shard`. They are set before the worker processes are forked,
+# so the workers inherit them instead of having them pickled with every
+# shard.
+_shard_data = None
+
+
+def _shard_edges(starts, length, shards):
+    """Split a sequence of groups into shards of about equal length.
+
+    Args:
+        starts: Sorted array of the index at which each group, except
+            the first, starts.
+        length: Length of the sequence.
+        shards: Maximum number of shards.
+
+    Returns:
+        List of the (start, end) index pairs of the shards, which only
+        end where a group starts.
+    """
+    targets = numpy.linspace(0, length, shards + 1)[1:-1]
+    cuts = numpy.searchsorted(starts, targets)
+    cuts = numpy.unique(starts[cuts[cuts < len(starts)]])
+    edges = [0] + cuts.tolist() + [length]
+    return zip(edges[:-1], edges[1:])
+
+
+def _assign_shard(bounds):
+    """Assign the check-ins of one shard of grid cells to blocks."""
+    longitude, latitude, _, _, blocks = _shard_data
+    start, end = bounds
+    return blocks.assign(longitude[start:end], latitude[start:end])
+
+
+def _count_shard(args):
+    """Count the pairs of one shard of users.
+
+    Args:
+        args: Tuple of the start and end of the shard in the user
+            ordered `user_ids` of `_shard_data`, and the positions of
+            the shard's check-ins.
+
+    Returns:
+        Tuple of the pairs and counts, as returned by `_count_pairs`.
+    """
+    _, _, user_ids, buckets, blocks = _shard_data
+    start, end, positions = args
+    if buckets is not None:
+        buckets = buckets[start:end]
+    return _count_pairs(positions, user_ids[start:end], len(blocks),
+                        buckets)
+
+
+def count_checkin_interactions(longitude, latitude, user_ids, blocks,
+                               workers=1, created_at=None):
+    """Assign check-ins to census blocks and count the interactions.
+
+    With several workers, the work is done in a pool of processes that
+    share the `blocks` index of the parent process. The check-ins are
+    first split into shards of whole grid cells of the index, which are
+    assigned to blocks, and then into shards of whole users, whose
+    block pairs are counted. The partial counts are summed, so the
+    result is the same as calling `BlockIndex.assign` and then
+    `count_interactions`.
+
+    Args:
+        longitude: Sequence of longitude float values of length *N*.
+        latitude: Sequence of latitude float values of length *N*.
+        user_ids: Sequence of the user ID for each check-in, in the
+            order the check-ins were made.
+        blocks: A `BlockIndex` of the census blocks.
+        workers: Number of worker processes. (Default: 1, which does
+            all of the work in the current process.)
+        created_at: Integer array of the seconds since the epoch of each
+            check-in, to count the interactions by time. (Default: None)
+
+    Returns:
+        Dictionary of interactions, as returned by `count_interactions`.
+    """
+    global _shard_data
+    user_ids = numpy.asarray(user_ids)
+    if workers <= 1 or not len(user_ids):
+        with instrument.stage('block lookup') as timer:
+            positions = blocks.assign(longitude, latitude)
+            timer.add(len(positions))
+        with instrument.stage('interaction counting') as timer:
+            interactions = count_interactions(positions, user_ids, blocks,
+                                              created_at)
+            timer.add(len(positions))
+        return interactions
+
+    # Keep each user's check-ins in their original order.
+    order = numpy.argsort(user_ids, kind='mergesort')
+    user_ids = user_ids[order]
+    longitude = numpy.asarray(longitude, dtype=float)[order]
+    latitude = numpy.asarray(latitude, dtype=float)[order]
+    buckets = None
+    if created_at is not None:
+        buckets = time_bucket(numpy.asarray(created_at)[order])
+    # The cost of `BlockIndex.assign` grows with the number of grid
+    # cells it visits, so the check-ins are assigned in shards of cells
+    # rather than of users, which would each visit most of the cells.
+    cols = numpy.floor(longitude / blocks.cell_size)
+    rows = numpy.floor(latitude / blocks.cell_size)
+    by_cell = numpy.lexsort((rows, cols))
+    cols, rows = cols[by_cell], rows[by_cell]
+    cell_starts = numpy.flatnonzero((cols[1:] != cols[:-1]) |
+                                    (rows[1:] != rows[:-1])) + 1
+    user_starts = numpy.flatnonzero(user_ids[1:] != user_ids[:-1]) + 1
+    # Several shards per worker balance the load.
+    shards = workers * 4
+
+    _shard_data = (longitude[by_cell], latitude[by_cell], user_ids, buckets,
+                   blocks)
+    pool = multiprocessing.Pool(workers)
+    try:
+        with instrument.stage('block lookup') as timer:
+            positions = numpy.empty(len(user_ids), dtype=int)
+            positions[by_cell] = numpy.concatenate(pool.map(
+                _assign_shard,
+                _shard_edges(cell_starts, len(user_ids), shards)))
+            timer.add(len(positions))
+        with instrument.stage('interaction counting') as timer:
+            results = pool.map(_count_shard, [
+                (start, end, positions[start:end]) for start, end
+                in _shard_edges(user_starts, len(user_ids), shards)])
+            timer.add(len(positions))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _shard_data = None
+
+    with instrument.stage('interaction counting'):
+        pairs = numpy.concatenate([x[0] for x in results])
+        counts = numpy.concatenate([x[1] for x in results])
+        pairs, inverse = numpy.unique(pairs, return_inverse=True)
+        counts = numpy.bincount(inverse, weights=counts,
+                                minlength=len(pairs)).astype(numpy.int64)
+        return _pairs_to_interactions(pairs, counts, blocks,
+                                      created_at is not None)
+
+
+def compute_block_interactions(users, blocks, workers=1):
+    """Compute census block interactions using Twitter data.
+
+    Args:
+        users: Dictionary with keys being users and values being a list
+            containing the ordered list of longitude-latitude points
+            that are associated with that user.
+        blocks: A `BlockIndex` of the census blocks, or a dictionary of
+            census block geometry objects with census block ID as the
+            key from which an index will be built.
+        workers: Number of worker processes, as used by
+            `count_checkin_interactions`. (Default: 1)
+
+    Returns:
+        Dictionary of block IDs with a dictionary that stores how many
+        times the source block interacted with the target block.
+    """
+    if not isinstance(blocks, BlockIndex):
+        blocks = BlockIndex(blocks)
+    checkins = [users[user] for user in users]
+    user_ids = numpy.repeat(numpy.arange(len(checkins)),
+                            [len(x) for x in checkins])
+    points = numpy.array(list(itertools.chain.from_iterable(checkins)),
+                         dtype=float).reshape(-1, 2)
+    return count_checkin_interactions(points[:, 0], points[:, 1], user_ids,
+                                      blocks, workers)
 
 
 def dump_interactions(interactions, fileobj):
@@ -209,3 +1162,244 @@ def load_interactions(fileobj):
         source, interaction = line.rstrip().split('\t')
         interactions[source] = json.loads(interaction)
     return interactions
+
+
+class InteractionMatrix(object):
+    """Compact sparse matrix of census block interactions.
+
+    Block IDs are interned to their position in a sorted array, and the
+    counts are stored both in compressed sparse row (CSR) form, for the
+    interactions from a block, and in compressed sparse column (CSC)
+    form, for the interactions to a block. All of the data is held in
+    NumPy arrays, which `load` memory-maps so that several server
+    processes share the same pages.
+
+    Interactions counted by time are stored with one entry per pair and
+    time bucket, with the indices of the block positions multiplied by
+    `TIME_BUCKETS` and the bucket added, so that the counts of a range
+    of buckets are summed at query time.
+
+    Attributes:
+        block_ids: Sorted NumPy string array of every block ID that is
+            the source or target of an interaction.
+        buckets: Number of time buckets of each pair of blocks, either 1
+            or `TIME_BUCKETS` if the interactions are counted by time.
+    """
+
+    ARRAYS = ('block_ids', 'row_indptr', 'row_indices', 'row_data',
+              'col_indptr', 'col_indices', 'col_data')
+
+    def __init__(self, block_ids, row_indptr, row_indices, row_data,
+                 col_indptr, col_indices, col_data, buckets=1):
+        self.block_ids = block_ids
+        self.buckets = buckets
+        self.row_indptr = row_indptr
+        self.row_indices = row_indices
+        self.row_data = row_data
+        self.col_indptr = col_indptr
+        self.col_indices = col_indices
+        self.col_data = col_data
+
+    @classmethod
+    def from_dict(cls, interactions):
+        """Create a matrix from a dictionary of interactions.
+
+        Args:
+            interactions: Dictionary of block IDs with a dictionary that
+                stores how many times the source block interacted with
+                the target block, or of interactions counted by time, as
+                returned by `count_interactions`.
+
+        Returns:
+            A new `InteractionMatrix`.
+        """
+        block_ids = set(interactions)
+        by_time = False
+        for source in interactions:
+            block_ids.update(interactions[source])
+            for count in interactions[source].itervalues():
+                by_time = isinstance(count, dict)
+                break
+        block_ids = numpy.array(sorted(str(x) for x in block_ids),
+                                dtype=str)
+        buckets = TIME_BUCKETS if by_time else 1
+        sources, targets, times, counts = [], [], [], []
+        for source in interactions:
+            for target, count in interactions[source].iteritems():
+                if not by_time:
+                    count = {0: count}
+                for bucket, bucket_count in count.iteritems():
+                    sources.append(str(source))
+                    targets.append(str(target))
+                    times.append(int(bucket))
+                    counts.append(bucket_count)
+        sources = numpy.searchsorted(block_ids, sources)
+        targets = numpy.searchsorted(block_ids, targets)
+        times = numpy.array(times, dtype=numpy.int64)
+        counts = numpy.array(counts, dtype=numpy.int64)
+        row = cls._compress(sources, targets * buckets + times, counts,
+                            len(block_ids))
+        col = cls._compress(targets, sources * buckets + times, counts,
+                            len(block_ids))
+        return cls(block_ids, *(row + col), buckets=buckets)
+
+    @staticmethod
+    def _compress(major, minor, data, size):
+        """Compressed sparse arrays: (indptr, indices, data)."""
+        order = numpy.lexsort((minor, major))
+        indptr = numpy.zeros(size + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(major, minlength=size), out=indptr[1:])
+        return (indptr, minor[order].astype(numpy.int32), data[order])
+
+    def save(self, path):
+        """Save the matrix to a directory of `.npy` files.
+
+        Args:
+            path: String of the path of the directory, which is created
+                if it does not exist.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in self.ARRAYS:
+            _save_array(os.path.join(path, name + '.npy'),
+                        getattr(self, name))
+        _save_array(os.path.join(path, 'buckets.npy'),
+                    numpy.array(self.buckets))
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a matrix saved by `save`.
+
+        Args:
+            path: String of the path of the directory.
+
+        Returns:
+            A new `InteractionMatrix` backed by read-only memory maps.
+        """
+        arrays = [numpy.load(os.path.join(path, name + '.npy'),
+                             mmap_mode='r')
+                  for name in cls.ARRAYS]
+        buckets = os.path.join(path, 'buckets.npy')
+        if os.path.exists(buckets):
+            buckets = int(numpy.load(buckets))
+        else:
+            buckets = 1  # Saved before interactions were counted by time.
+        return cls(*arrays, buckets=buckets)
+
+    def position(self, block_id):
+        """Position of a block ID in `block_ids`, or None."""
+        if block_id is None or not len(self.block_ids):
+            return None
+        position = int(numpy.searchsorted(self.block_ids, block_id))
+        if (position < len(self.block_ids) and
+                self.block_ids[position] == block_id):
+            return position
+        return None
+
+    def __contains__(self, block_id):
+        """Whether the block is the source of any interaction."""
+        position = self.position(block_id)
+        return (position is not None and
+                self.row_indptr[position] < self.row_indptr[position + 1])
+
+    def _vector(self, indptr, indices, data, block_id, buckets=None):
+        """Dictionary of the non-zero block IDs and counts of a vector.
+
+        Raises:
+            ValueError if `buckets` are given but the interactions were
+            not counted by time.
+        """
+        if buckets is not None and self.buckets == 1:
+            raise ValueError('The interactions were not counted by time.')
+        position = self.position(block_id)
+        if position is None:
+            return dict()
+        start, end = indptr[position], indptr[position + 1]
+        indices, data = indices[start:end], data[start:end]
+        if self.buckets > 1:
+            if buckets is not None:
+                keep = numpy.in1d(indices % self.buckets, buckets)
+                indices, data = indices[keep], data[keep]
+            # The indices are sorted, so the buckets of each block are
+            # next to each other.
+            indices, starts = numpy.unique(indices // self.buckets,
+                                           return_index=True)
+            if len(starts):
+                data = numpy.add.reduceat(data, starts)
+        block_ids = self.block_ids[indices].tolist()
+        return dict(itertools.izip(block_ids, data.tolist()))
+
+    def row(self, block_id, buckets=None):
+        """Dictionary of the counts of interactions from a block.
+
+        Args:
+            block_id: The census block ID.
+            buckets: Sequence of the time buckets, as numbered by
+                `time_bucket`, whose counts are summed. (Default: None,
+                which sums every bucket.)
+        """
+        return self._vector(self.row_indptr, self.row_indices,
+                            self.row_data, block_id, buckets)
+
+    def column(self, block_id, buckets=None):
+        """Dictionary of the counts of interactions to a block.
+
+        The `buckets` are the same as for `row`.
+        """
+        return self._vector(self.col_indptr, self.col_indices,
+                            self.col_data, block_id, buckets)
+
+    def undirected(self, block_id, buckets=None):
+        """Dictionary of the counts of interactions in either direction.
+
+        The interactions of a block with itself are only counted once.
+        The `buckets` are the same as for `row`.
+        """
+        counts = self.row(block_id, buckets)
+        for source, count in self.column(block_id, buckets).iteritems():
+            if source != block_id:
+                counts[source] = counts.get(source, 0) + count
+        return counts
+
+    def to_dict(self):
+        """Dictionary of interactions, as returned by `load_interactions`.
+
+        Interactions counted by time are summed over every time bucket.
+        """
+        interactions = dict()
+        for position, block_id in enumerate(self.block_ids.tolist()):
+            if self.row_indptr[position] < self.row_indptr[position + 1]:
+                interactions[block_id] = self.row(block_id)
+        return interactions
+
+
+def load_interaction_matrix(path, cache=None):
+    """Load census block interactions as a memory-mapped matrix.
+
+    The matrix is compiled from the interactions file the first time,
+    and again whenever the file changes. When several processes load
+    the same changed file at once, only the first compiles it, and the
+    others wait for it and then memory-map the result.
+
+    Args:
+        path: String of the path of the file saved by
+            `dump_interactions`.
+        cache: String of the path of the compiled matrix directory.
+            (Default: the `path` with `.matrix` added.)
+
+    Returns:
+        An `InteractionMatrix` backed by read-only memory maps.
+    """
+    if cache is None:
+        cache = path + '.matrix'
+    if not _is_fresh(path, cache):
+        with _build_lock(cache):
+            # Another process may have compiled it while we waited.
+            if not _is_fresh(path, cache):
+                key = _archive_key(path)
+                with open(path) as f:
+                    matrix = InteractionMatrix.from_dict(
+                        load_interactions(f))
+                matrix.save(cache)
+                _save_key(cache, key)
+    return InteractionMatrix.load(cache)
@@ -0,0 +1,264 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Single pass, bounded memory aggregation of check-ins.
+
+Instead of holding every check-in in memory, check-ins are read in
+chunks and added to accumulators whose size depends only on the output:
+a 2D histogram for the heat map, an hour of day histogram, the number of
+check-ins per user, the census block interaction counts, and fixed size
+random samples of check-ins and of user movements for the maps.
+"""
+from __future__ import division
+import calendar
+import collections
+import itertools
+
+import numpy
+
+import instrument
+import process
+
+
+def iter_chunks(data, chunk_size=100000):
+    """Group the output of `process.extract_data` into array chunks.
+
+    Args:
+        data: Iterable of the tuple outputs from `process.extract_data`.
+        chunk_size: Maximum number of check-ins in each chunk.
+
+    Yields:
+        NumPy array with the `process.CHECKIN_DTYPE` fields.
+    """
+    data = iter(data)
+    while True:
+        chunk = [(longitude, latitude,
+                  calendar.timegm(created_at.utctimetuple()), user_id)
+                 for longitude, latitude, created_at, user_id
+                 in itertools.islice(data, chunk_size)]
+        if not chunk:
+            return
+        yield numpy.array(chunk, dtype=process.CHECKIN_DTYPE)
+
+
+def iter_array_chunks(checkins, chunk_size=100000):
+    """Split a check-in array, such as from `process.load_checkins`.
+
+    Args:
+        checkins: NumPy array with the `process.CHECKIN_DTYPE` fields.
+        chunk_size: Maximum number of check-ins in each chunk.
+
+    Yields:
+        Consecutive slices of `checkins`.
+    """
+    for start in xrange(0, len(checkins), chunk_size):
+        yield checkins[start:start + chunk_size]
+
+
+class Reservoir(object):
+    """Uniform random sample of fixed size from a stream of rows.
+
+    Attributes:
+        rows: NumPy array of the sampled rows.
+        seen: Number of rows offered to the sample.
+    """
+
+    def __init__(self, size, columns, seed=0):
+        """Creates a new empty sample.
+
+        Args:
+            size: Maximum number of rows in the sample.
+            columns: Number of float values in each row.
+            seed: Seed for the random number generator.
+        """
+        self.size = size
+        self.seen = 0
+        self._rows = numpy.empty((size, columns))
+        self._random = numpy.random.RandomState(seed)
+
+    @property
+    def rows(self):
+        return self._rows[:min(self.seen, self.size)]
+
+    def add(self, rows):
+        """Offer a chunk of rows to the sample.
+
+        Args:
+            rows: NumPy array with one row per item.
+        """
+        count = len(rows)
+        fill = max(0, min(count, self.size - self.seen))
+        self._rows[self.seen:self.seen + fill] = rows[:fill]
+        if fill < count:
+            # Algorithm R: the n-th item replaces a random sampled item
+            # with probability size / n.
+            seen = numpy.arange(self.seen + fill + 1, self.seen + count + 1)
+            slots = (self._random.random_sample(len(seen)) *
+                     seen).astype(int)
+            keep = slots < self.size
+            self._rows[slots[keep]] = rows[fill:][keep]
+        self.seen += count
+
+
+class CheckinStats(object):
+    """Accumulators for everything the plots need from the check-ins.
+
+    Attributes:
+        box: The bounding box the heat map covers.
+        heatmap: 2D NumPy array of check-in counts, indexed by the
+            longitude bin and then the latitude bin.
+        heatmap_edges: Tuple of the longitude and latitude bin edges.
+        hours: NumPy array of the check-in counts for each hour of day.
+        user_checkins: Counter of the number of check-ins per user.
+        sample: `Reservoir` of (longitude, latitude, time of day) rows.
+        movements: `Reservoir` of (source longitude, source latitude,
+            target longitude, target latitude) rows, one for each pair
+            of consecutive check-ins by a user.
+        blocks: The `process.BlockIndex` used to count interactions, or
+            None to not count interactions.
+        last: Dictionary of user ID with the tuple (longitude, latitude,
+            position in `blocks.block_ids` or -1) of the user's last
+            check-in so far.
+    """
+
+    def __init__(self, box, blocks=None, bins=128, sample_size=100000,
+                 seed=0, last=None):
+        """Creates new empty accumulators.
+
+        Args:
+            box = A pair of longitude and latitude pairs, with the
+                southwest corner of the bounding box coming first.
+            blocks: A `process.BlockIndex` of the census blocks used to
+                count interactions. (Default: None)
+            bins: Number of heat map bins along each axis.
+            sample_size: Maximum number of check-ins and of movements
+                kept for the maps.
+            seed: Seed for the random number generator.
+            last: Dictionary of the last check-in of users from
+                check-ins added to earlier accumulators, in the same
+                form as the `last` attribute, so that movements from
+                those check-ins are also counted. (Default: None)
+        """
+        self.box = box
+        self.heatmap_edges = (numpy.linspace(box[0], box[2], bins + 1),
+                              numpy.linspace(box[1], box[3], bins + 1))
+        self.heatmap = numpy.zeros((bins, bins), dtype=int)
+        self.hours = numpy.zeros(24, dtype=int)
+        self.user_checkins = collections.Counter()
+        self.sample = Reservoir(sample_size, 3, seed)
+        self.movements = Reservoir(sample_size, 4, seed + 1)
+        self.blocks = blocks
+        self._pairs = collections.Counter()
+        self.last = dict(last or {})
+
+    def add(self, checkins):
+        """Add a chunk of check-ins to the accumulators.
+
+        Args:
+            checkins: NumPy array with the `process.CHECKIN_DTYPE`
+                fields, in the order the check-ins were made.
+        """
+        if not len(checkins):
+            return
+        longitude = numpy.asarray(checkins['longitude'])
+        latitude = numpy.asarray(checkins['latitude'])
+        seconds = numpy.asarray(checkins['created_at'])
+        user_ids = numpy.asarray(checkins['user_id'])
+
+        grid, _, _ = numpy.histogram2d(longitude, latitude,
+                                       bins=self.heatmap_edges)
+        self.heatmap += grid.astype(int)
+        self.hours += numpy.bincount(seconds % 86400 // 3600, minlength=24)
+        time = (seconds % 86400 // 3600) + (seconds % 3600 // 60 / 60)
+        self.sample.add(numpy.column_stack((longitude, latitude, time)))
+
+        if self.blocks is not None:
+            with instrument.stage('block lookup') as timer:
+                positions = self.blocks.assign(longitude, latitude)
+                timer.add(len(positions))
+        else:
+            positions = numpy.empty(len(checkins), dtype=int)
+            positions.fill(-1)
+
+        buckets = process.time_bucket(seconds)
+
+        users, counts = numpy.unique(user_ids, return_counts=True)
+        self.user_checkins.update(dict(itertools.izip(users.tolist(),
+                                                      counts.tolist())))
+        # Prepend the last check-in of each user from earlier chunks, so
+        # that movements spanning two chunks are also counted.
+        previous = [(user, self.last[user]) for user in users.tolist()
+                    if user in self.last]
+        if previous:
+            user_ids = numpy.concatenate(([x[0] for x in previous],
+                                          user_ids))
+            longitude = numpy.concatenate(([x[1][0] for x in previous],
+                                           longitude))
+            latitude = numpy.concatenate(([x[1][1] for x in previous],
+                                          latitude))
+            positions = numpy.concatenate(([x[1][2] for x in previous],
+                                           positions))
+            # Pairs are counted in the bucket of the target check-in, so
+            # the bucket of a previous check-in is never used.
+            buckets = numpy.concatenate((numpy.zeros(len(previous), int),
+                                         buckets))
+
+        order = numpy.argsort(user_ids, kind='mergesort')
+        user_ids = user_ids[order]
+        longitude, latitude = longitude[order], latitude[order]
+        positions, buckets = positions[order], buckets[order]
+
+        same_user = user_ids[1:] == user_ids[:-1]
+        self.movements.add(numpy.column_stack(
+            (longitude[:-1], latitude[:-1],
+             longitude[1:], latitude[1:]))[same_user])
+
+        source, target = positions[:-1], positions[1:]
+        valid = same_user & (source >= 0) & (target >= 0)
+        if self.blocks is not None and valid.any():
+            with instrument.stage('interaction counting') as timer:
+                pairs = source[valid] * len(self.blocks) + target[valid]
+                pairs = pairs * process.TIME_BUCKETS + buckets[1:][valid]
+                pairs, counts = numpy.unique(pairs, return_counts=True)
+                self._pairs.update(dict(itertools.izip(pairs.tolist(),
+                                                       counts.tolist())))
+                timer.add(len(checkins))
+
+        last = numpy.append(user_ids[1:] != user_ids[:-1], True)
+        for user, x, y, position in itertools.izip(
+                user_ids[last].tolist(), longitude[last].tolist(),
+                latitude[last].tolist(), positions[last].tolist()):
+            self.last[user] = (x, y, position)
+
+    @property
+    def interactions(self):
+        """Census block interactions of all check-ins added so far.
+
+        Returns:
+            Dictionary of block IDs with a dictionary that stores how
+            many times the source block interacted with the target
+            block, the same as `process.compute_block_interactions`.
+        """
+        interactions = collections.defaultdict(collections.Counter)
+        block_ids = self.blocks.block_ids
+        for pair, count in self._pairs.iteritems():
+            source, target = divmod(pair // process.TIME_BUCKETS,
+                                    len(block_ids))
+            interactions[block_ids[source]][block_ids[target]] += count
+        return dict(interactions)
+
+    @property
+    def interactions_by_time(self):
+        """Census block interactions counted by time.
+
+        Returns:
+            Dictionary of interactions counted by time, the same as
+            `process.count_interactions` with `created_at`.
+        """
+        interactions = collections.defaultdict(
+            lambda: collections.defaultdict(dict))
+        block_ids = self.blocks.block_ids
+        for pair, count in self._pairs.iteritems():
+            pair, bucket = divmod(pair, process.TIME_BUCKETS)
+            source, target = divmod(pair, len(block_ids))
+            interactions[block_ids[source]][block_ids[target]][bucket] = count
+        return dict((source, dict(targets))
+                    for source, targets in interactions.iteritems())
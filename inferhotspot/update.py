@@ -0,0 +1,301 @@
+# Copyright (C) 2013 Wesley Baugh
+"""Incrementally update the census block interactions with new archives.
+
+The collector adds a new bz2 file of tweets to the filter directory
+every hour. Instead of filtering and processing every file again, the
+names, sizes, and modification times of the files that have been
+consumed are recorded in a JSON state file, together with the last
+check-in of each user. Only the files that have not been consumed are
+filtered and processed, the movements of each user continue from their
+last check-in, and the new interaction counts are added to the existing
+`census-block-interactions.tsv` and `census-block-interactions-by-time.tsv`.
+
+The first run, when there is no state file, consumes every file and
+replaces any existing interactions files instead of adding to them, so
+the interactions are the same as filtering all of the files with
+`filter.py` and then running `plot.py`. Files modified recently are
+left for a later run, since the collector may still be writing them.
+
+The new interactions files and state file are first written to
+temporary files. The state file then records the renames that replace
+the old files, and is itself replaced, which commits the update. If the
+update is interrupted before then, the old files are unchanged, and if
+it is interrupted afterwards, the next run finishes the renames. Either
+way, no file is counted twice.
+"""
+import argparse
+import bisect
+import glob
+import json
+import os
+import tempfile
+import time
+
+from config import get_config
+from filter import FilterInBox, FilterStatus, filter_archive
+import process
+import stream
+
+
+INTERACTIONS_FNAME = 'census-block-interactions.tsv'
+INTERACTIONS_BY_TIME_FNAME = 'census-block-interactions-by-time.tsv'
+STATE_FNAME = 'census-block-interactions.state.json'
+# Seconds since a file was last modified before it is consumed.
+MIN_AGE = 600
+
+
+def load_state(fname=STATE_FNAME):
+    """Load the record of the consumed archives and last check-ins.
+
+    Args:
+        fname: String of the path of the JSON state file.
+
+    Returns:
+        Dictionary with the `archives` dictionary of consumed filename
+        with its size and modification time, as from
+        `process._archive_key`, and the `last` dictionary of user ID
+        with a list of the longitude, latitude, and census block ID (or
+        None) of the user's last check-in. Both are empty if the state
+        file does not exist. A `pending` list of the temporary and final
+        path of each file to rename is also present if an update was
+        committed but not finished, as with `finish_commit`.
+    """
+    try:
+        with open(fname) as f:
+            state = json.load(f)
+    except IOError:
+        return {'archives': {}, 'last': {}}
+    state['last'] = dict((int(user), last)
+                         for user, last in state['last'].iteritems())
+    return state
+
+
+def save_state(state, fname=STATE_FNAME):
+    """Save the state as returned by `load_state`, replacing the file."""
+    with open(fname + '.tmp', mode='w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(fname + '.tmp', fname)
+
+
+def finish_commit(state, fname=STATE_FNAME):
+    """Rename the files of a committed update over the old files.
+
+    Args:
+        state: Dictionary of the state, as returned by `load_state`,
+            whose `pending` renames are done and removed.
+        fname: String of the path of the JSON state file, which is
+            saved without the `pending` renames.
+    """
+    for temporary, final in state.pop('pending', []):
+        # The file was already renamed if the update was interrupted
+        # after renaming it.
+        if os.path.exists(temporary):
+            os.rename(temporary, final)
+    save_state(state, fname)
+
+
+def new_archives(directory, consumed, min_age=MIN_AGE):
+    """Find the bz2 files that have not been consumed.
+
+    Args:
+        directory: The directory containing bz2-archive files.
+        consumed: Dictionary of consumed filenames, as in the state's
+            `archives`.
+        min_age: Number of seconds since a file was last modified
+            before it is consumed, so that a file the collector is still
+            writing is left for a later run. (Default: `MIN_AGE`)
+
+    Returns:
+        List of the paths of the new files, in sorted filename order,
+        which is the order `filter.combine_filter` combines them in.
+    """
+    fnames = []
+    now = time.time()
+    for fname in sorted(glob.glob(os.path.join(directory, '*.bz2'))):
+        name = os.path.basename(fname)
+        if name in consumed:
+            if consumed[name] != process._archive_key(fname):
+                print ('Warning: a consumed file was modified afterwards, '
+                       'and its new tweets are not counted:'), fname
+        elif now - os.path.getmtime(fname) < min_age:
+            print 'Skipping recently modified file:', fname
+        else:
+            fnames.append(fname)
+    return fnames
+
+
+def iter_filtered(fname, filters, status):
+    """Filter a bz2 file and get the matching tweets.
+
+    Args:
+        fname: The filename of the bz2-archive file.
+        filters: Collection of callable objects, as in
+            `filter.combine_filter`.
+        status: `FilterStatus` object to update.
+
+    Yields:
+        Dictionary of each matching tweet, in the order of the file.
+    """
+    with tempfile.TemporaryFile() as matches:
+        filter_archive(fname, matches, filters, status)
+        matches.seek(0)
+        for line in matches:
+            yield json.loads(line)
+
+
+def merge_interactions(interactions, new):
+    """Add new interaction counts to existing interactions.
+
+    Args:
+        interactions: Dictionary of interactions, possibly counted by
+            time, as returned by `process.load_interactions`, which is
+            updated.
+        new: Dictionary of the interactions to add, in the same form.
+    """
+    for source, targets in new.iteritems():
+        counts = interactions.setdefault(source, {})
+        for target, count in targets.iteritems():
+            if isinstance(count, dict):
+                # The time buckets of a loaded file are JSON strings.
+                buckets = counts.setdefault(target, {})
+                for bucket, bucket_count in count.iteritems():
+                    bucket = str(bucket)
+                    buckets[bucket] = buckets.get(bucket, 0) + bucket_count
+            else:
+                counts[target] = counts.get(target, 0) + count
+
+
+def write_merged(fname, new, merge=True):
+    """Write the counts of a file with new counts added to a new file.
+
+    Args:
+        fname: String of the path of the file saved by
+            `process.dump_interactions`, which need not exist.
+        new: Dictionary of the interactions to add, as for
+            `merge_interactions`.
+        merge: Boolean whether to add the counts of the existing file,
+            otherwise only the `new` counts are written.
+
+    Returns:
+        String of the path of the new file, which is next to `fname`,
+        and is renamed over it when the update is committed.
+    """
+    interactions = dict()
+    if merge:
+        try:
+            with open(fname) as f:
+                interactions = process.load_interactions(f)
+        except IOError:
+            pass
+    merge_interactions(interactions, new)
+    with open(fname + '.tmp', mode='w') as f:
+        process.dump_interactions(interactions, f)
+        f.flush()
+        os.fsync(f.fileno())
+    return fname + '.tmp'
+
+
+def update_interactions(directory, filters, blocks, box,
+                        interactions_fname=INTERACTIONS_FNAME,
+                        interactions_by_time_fname=INTERACTIONS_BY_TIME_FNAME,
+                        state_fname=STATE_FNAME, min_age=MIN_AGE):
+    """Add the interactions of the tweets in new bz2 files.
+
+    Args:
+        directory: The directory containing bz2-archive files. Each line
+            of the uncompressed file must be a JSON encoded tweet.
+        filters: Collection of callable objects, as in
+            `filter.combine_filter`, that select the tweets to process.
+        blocks: A `process.BlockIndex` of the census blocks.
+        box = A pair of longitude and latitude pairs, with the southwest
+            corner of the bounding box coming first.
+        interactions_fname: String of the path of the interactions file,
+            which is created if it does not exist, and replaced if there
+            is no state file.
+        interactions_by_time_fname: String of the path of the file of
+            the interactions counted by time, which is created or
+            replaced the same way.
+        state_fname: String of the path of the JSON state file.
+        min_age: Number of seconds since a file was last modified
+            before it is consumed, as for `new_archives`.
+
+    Returns:
+        List of the paths of the bz2 files that were consumed.
+    """
+    # Without a state file, no archive has been counted in the existing
+    # interactions files, such as those saved by `plot.py`, so they are
+    # replaced rather than added to.
+    merge = os.path.exists(state_fname)
+    state = load_state(state_fname)
+    if 'pending' in state:
+        print 'Finishing the interrupted update'
+        finish_commit(state, state_fname)
+    fnames = new_archives(directory, state['archives'], min_age)
+    if not fnames:
+        return fnames
+    if not merge:
+        print 'No state file, so the interactions files are replaced'
+
+    # The last check-ins are saved with block IDs rather than positions,
+    # so that they stay valid if the census blocks file changes.
+    last = dict()
+    for user, (longitude, latitude, block_id) in state['last'].iteritems():
+        position = -1
+        if block_id is not None:
+            index = bisect.bisect_left(blocks.block_ids, block_id)
+            if index < len(blocks) and blocks.block_ids[index] == block_id:
+                position = index
+        last[user] = (longitude, latitude, position)
+    stats = stream.CheckinStats(box, blocks, bins=1, sample_size=0,
+                                last=last)
+    status = FilterStatus()
+    for fname in fnames:
+        print 'Processing:', fname
+        key = process._archive_key(fname)
+        tweets = iter_filtered(fname, filters, status)
+        for chunk in stream.iter_chunks(process.extract_data(tweets)):
+            stats.add(chunk)
+        state['archives'][os.path.basename(fname)] = key
+    print status
+
+    state['pending'] = [
+        (write_merged(interactions_fname, stats.interactions, merge),
+         interactions_fname),
+        (write_merged(interactions_by_time_fname,
+                      stats.interactions_by_time, merge),
+         interactions_by_time_fname)]
+    state['last'] = dict(
+        (user, (longitude, latitude,
+                blocks.block_ids[position] if position >= 0 else None))
+        for user, (longitude, latitude, position) in stats.last.iteritems())
+    # Saving the state with the pending renames commits the update.
+    save_state(state, state_fname)
+    finish_commit(state, state_fname)
+    return fnames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--min-age', type=float, default=MIN_AGE,
+                        metavar='SECONDS',
+                        help='seconds since a file was last modified '
+                             'before it is consumed (default: %(default)s)')
+    args = parser.parse_args()
+
+    config = get_config()
+    path = config.get('filter', 'process_directory')
+    box = json.loads(config.get('place', 'box'))
+
+    print 'Extracting census blocks ...',
+    census_path = config.get('census', 'path')
+    census_blocks = config.get('census', 'blocks')
+    blocks = process.load_blocks(os.path.join(census_path, census_blocks))
+    blocks = process.BlockIndex(blocks)
+    print 'DONE'
+
+    filters = [FilterInBox(box)]
+    fnames = update_interactions(path, filters, blocks, box,
+                                 min_age=args.min_age)
+    print 'Consumed {0} new files'.format(len(fnames))
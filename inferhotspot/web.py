@@ -1,21 +1,333 @@
 # Copyright (C) 2013 Wesley Baugh
 """Web interface for displaying hotspot related information."""
 from __future__ import division
+import collections
 import colorsys
-import copy
+import hashlib
 import json
 import logging
+import math
+import multiprocessing
 import os
+import signal
 import socket
 import subprocess
+import time
+import uuid
 
+import concurrent.futures
 import shapely
+import tornado.gen
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
 import tornado.httpserver
 
+import metrics
 import process
-from config import get_config
+from config import get_config, get_setting
+
+
+class LRUCache(object):
+    """Mapping that discards the least recently used items when full.
+
+    Attributes:
+        max_size: Maximum number of items kept.
+        hits: Number of `get` calls that found the key.
+        misses: Number of `get` calls that did not find the key.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        if self.max_size <= 0:
+            return
+        if len(self._items) >= self.max_size:
+            self._items.popitem(last=False)
+        self._items[key] = value
+
+    def get(self, key, default=None):
+        """Get an item, marking it as the most recently used."""
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items[key] = value
+        self.hits += 1
+        return value
+
+    def clear(self):
+        """Remove all items."""
+        self._items.clear()
+
+
+# Settings of the application of each `QueryExecutor`, by the executor's
+# key. They are registered when the executor is created, and so are
+# inherited by the processes of a process pool, which are forked when
+# the first query is submitted, instead of being pickled with every
+# query. Each executor only runs queries with its own settings, even if
+# several applications are made in the same process.
+_query_settings = dict()
+
+
+def _timed(key, function, *args):
+    """Call a query function with the settings of an executor.
+
+    Args:
+        key: The key of the executor in `_query_settings`.
+        function: Query function, called with the settings and `args`.
+        args: Arguments of the function.
+
+    Returns:
+        Tuple of the result, and when the call started and finished.
+    """
+    started = time.time()
+    result = function(_query_settings[key], *args)
+    return result, started, time.time()
+
+
+def find_block(settings, longitude, latitude):
+    """Find the census block that contains a point.
+
+    Args:
+        settings: Dictionary of the application settings.
+        longitude: Float of the longitude coordinate.
+        latitude: Float of the latitude coordinate.
+
+    Returns:
+        The census block ID, or None if the point is not in any block.
+    """
+    point = shapely.geometry.Point(longitude, latitude)
+    return process.point_to_block(point, settings['blocks'])
+
+
+def interaction_blocks(settings, block_id, directed, buckets=None):
+    """Find the census blocks to be rendered for a source block.
+
+    Args:
+        settings: Dictionary of the application settings.
+        block_id: The source block ID, or None.
+        directed: Boolean whether order of interactions matters.
+        buckets: Sequence of the time buckets whose interactions are
+            counted, as from `process.time_buckets`. (Default: None,
+            which counts all interactions.)
+
+    Returns:
+        List of tuples: (target_block_id, path, weight), where the path
+        is the encoded polyline of the block outline and the weight is
+        the interaction count normalized to between 0 and 1. The list is
+        empty if the source block has no interactions.
+    """
+    interactions = settings['interactions']
+    if block_id not in interactions:
+        return []
+    if directed:
+        interactions = interactions.row(block_id, buckets)
+    else:
+        interactions = interactions.undirected(block_id, buckets)
+    if not interactions:
+        return []
+    maximum = max(interactions.values())
+    block_paths = settings['block_paths']
+    return [(target_block_id, block_paths[target_block_id], count / maximum)
+            for target_block_id, count in interactions.iteritems()]
+
+
+class QueryExecutor(object):
+    """Runs queries in a pool so that they do not block the IOLoop.
+
+    At most `max_pending` queries may be submitted and not yet finished
+    at a time; any more are refused with 503 Service Unavailable. The
+    queries are run with the settings of the executor's application.
+
+    Attributes:
+        max_pending: Maximum number of queries submitted at a time.
+        pending: Number of queries submitted and not yet finished.
+        rejected: Number of queries refused because `max_pending`
+            queries were pending.
+        finished: Number of queries finished.
+        queue_time: Total seconds queries waited for a worker.
+        compute_time: Total seconds queries ran in a worker.
+    """
+
+    def __init__(self, kind, workers, max_pending, settings):
+        """Creates a new pool.
+
+        Args:
+            kind: String, either 'thread' or 'process', of the kind of
+                worker the queries are run by.
+            workers: Number of workers, or 0 for one per CPU.
+            max_pending: Maximum number of queries submitted at a time.
+            settings: Dictionary of the application settings, which is
+                passed to the query functions.
+        """
+        if kind not in ('thread', 'process'):
+            raise ValueError('Unknown executor kind: {0}'.format(kind))
+        self._key = uuid.uuid4().hex
+        _query_settings[self._key] = settings
+        self._kind = kind
+        self._workers = workers or multiprocessing.cpu_count()
+        self._executor = self._make_executor()
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.finished = 0
+        self.queue_time = 0
+        self.compute_time = 0
+
+    def _make_executor(self):
+        if self._kind == 'thread':
+            return concurrent.futures.ThreadPoolExecutor(self._workers)
+        return concurrent.futures.ProcessPoolExecutor(self._workers)
+
+    def restart(self):
+        """Make later queries see changes to the application settings.
+
+        Worker processes have a copy of the settings from when they were
+        forked, so they are replaced by new ones; queries already
+        submitted still finish in the old workers. Worker threads share
+        the settings, so nothing needs to be done for them.
+        """
+        if self._kind == 'process':
+            executor, self._executor = self._executor, self._make_executor()
+            executor.shutdown(wait=False)
+
+    @tornado.gen.coroutine
+    def run(self, function, *args):
+        """Run a query in a worker.
+
+        Args:
+            function: Module level function of the query, so that it can
+                be run by a worker process. It is called with the
+                settings of the executor followed by the `args`.
+            args: Arguments of the function.
+
+        Returns:
+            Tuple of the result, the seconds the query waited for a
+            worker, and the seconds it ran in the worker.
+
+        Raises:
+            HTTPError 503 if `max_pending` queries are pending.
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise tornado.web.HTTPError(503)  # 503 Service Unavailable
+        self.pending += 1
+        submitted = time.time()
+        try:
+            result, started, finished = yield self._executor.submit(
+                _timed, self._key, function, *args)
+        finally:
+            self.pending -= 1
+        queue_time = max(0, started - submitted)
+        compute_time = finished - started
+        self.finished += 1
+        self.queue_time += queue_time
+        self.compute_time += compute_time
+        raise tornado.gen.Return((result, queue_time, compute_time))
+
+    def shutdown(self):
+        """Stop the workers after the pending queries finish."""
+        self._executor.shutdown()
+        _query_settings.pop(self._key, None)
+
+
+class ServerMetrics(object):
+    """Metrics of the requests served by the application.
+
+    The metrics are updated on the IOLoop thread, and are those of the
+    current process only. Besides the metrics below, the registry has
+    the counts of the response cache and the query executor, which are
+    read from the application settings when the metrics are exposed.
+    If the `worker` setting is not None, every sample has a `worker`
+    label with its value, so that the metrics of the forked server
+    processes can be told apart once they are scraped.
+
+    Attributes:
+        registry: The `metrics.Registry` exposed by `MetricsHandler`.
+        requests: `metrics.Counter` of the finished requests by handler
+            and status code.
+        latency: `metrics.Histogram` of the seconds taken to serve each
+            request by handler.
+        phases: `metrics.Histogram` of the seconds spent in each phase
+            of a request by handler and phase: `lookup` of the census
+            block, `assembly` of the interactions, and `render` of the
+            template or JSON response.
+    """
+
+    def __init__(self, settings):
+        """Creates the metrics.
+
+        Args:
+            settings: Dictionary of the application settings, from which
+                the `worker`, `response_cache`, and `query_executor` are
+                read.
+        """
+        worker = settings.get('worker')
+        self.registry = registry = metrics.Registry(
+            [] if worker is None else [('worker', worker)])
+        self.requests = registry.add(metrics.Counter(
+            'inferhotspot_http_requests_total',
+            'Requests finished, by handler and status code.',
+            ('handler', 'code')))
+        self.latency = registry.add(metrics.Histogram(
+            'inferhotspot_http_request_duration_seconds',
+            'Seconds taken to serve a request, by handler.',
+            ('handler',)))
+        self.phases = registry.add(metrics.Histogram(
+            'inferhotspot_http_request_phase_seconds',
+            'Seconds spent in a phase of a request, by handler and phase.',
+            ('handler', 'phase')))
+        for name, help, kind, function in [
+                ('response_cache_hits_total', 'Response cache hits.',
+                 'counter', lambda: settings['response_cache'].hits),
+                ('response_cache_misses_total', 'Response cache misses.',
+                 'counter', lambda: settings['response_cache'].misses),
+                ('query_pending', 'Queries submitted and not finished.',
+                 'gauge', lambda: settings['query_executor'].pending),
+                ('query_rejected_total', 'Queries refused with 503.',
+                 'counter', lambda: settings['query_executor'].rejected),
+                ('query_queue_seconds_total',
+                 'Seconds queries waited for a worker.',
+                 'counter', lambda: settings['query_executor'].queue_time),
+                ('query_compute_seconds_total',
+                 'Seconds queries ran in a worker.',
+                 'counter',
+                 lambda: settings['query_executor'].compute_time)]:
+            registry.add(metrics.Callback('inferhotspot_' + name, help,
+                                          kind, function))
+
+    def observe_request(self, handler):
+        """Count a finished request and observe its latency."""
+        name = type(handler).__name__
+        self.requests.inc(name, handler.get_status())
+        self.latency.observe(handler.request.request_time(), name)
+
+
+class Application(tornado.web.Application):
+    """Application that records the `ServerMetrics` of every request.
+
+    The metrics are the `metrics` setting.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Application, self).__init__(*args, **kwargs)
+        self.settings['metrics'] = ServerMetrics(self.settings)
+
+    def log_request(self, handler):
+        """Log a finished request, and add it to the metrics."""
+        super(Application, self).log_request(handler)
+        self.settings['metrics'].observe_request(handler)
 
 
 class MainHandler(tornado.web.RequestHandler):
@@ -26,17 +338,29 @@ class MainHandler(tornado.web.RequestHandler):
         self.box = self.application.settings.get('box')
         self.blocks = self.application.settings.get('blocks')
         self.interactions = self.application.settings.get('interactions')
+        self.response_cache = self.application.settings.get('response_cache')
+        self.block_paths = self.application.settings.get('block_paths')
+        self.metrics = self.application.settings.get('metrics')
+
+    def _phase(self, phase):
+        """Context manager that times a phase of the request.
+
+        Args:
+            phase: String of the phase, as in `ServerMetrics.phases`.
+        """
+        return self.metrics.phases.time(type(self).__name__, phase)
 
     def head(self, *args):
         """Handle HEAD requests by sending an identical GET response."""
-        self.get(*args)
+        return self.get(*args)
 
     def get(self):
         """Renders the query input page."""
-        self.render('index.html',
-                    box=self.box,
-                    blocks=self.blocks,
-                    git_version=self.git_version)
+        with self._phase('render'):
+            self.render('index.html',
+                        box=self.box,
+                        blocks=self.blocks,
+                        git_version=self.git_version)
 
 
 class InteractionHandler(MainHandler):
@@ -45,14 +369,50 @@ class InteractionHandler(MainHandler):
     def get(self):
         """Renders the census block interactions result page.
 
+        The interactions themselves are fetched by the page from
+        `InteractionApiHandler`.
+
         GET Parameters:
             latitude: Float of the latitude coordinate.
             longitude: Float of the longitude coordinate.
             edges: String, either 'directed' or 'undirected', indicating
                 whether order of interactions matters.
+            hour_from, hour_to, weekday: Optional time window, as used
+                by `_time_window`.
+        """
+        latitude, longitude, directed = self._query_arguments()
+        self._time_window()
+        with self._phase('render'):
+            self.render('interaction.html',
+                        box=self.box,
+                        latitude=latitude,
+                        longitude=longitude,
+                        directed=directed,
+                        hour_from=self.get_argument('hour_from', ''),
+                        hour_to=self.get_argument('hour_to', ''),
+                        weekday=self.get_argument('weekday', ''),
+                        by_time=self.interactions.buckets > 1,
+                        git_version=self.git_version)
+
+    def _query_arguments(self):
+        """Parse the GET parameters of an interaction query.
+
+        Returns:
+            Tuple of the latitude, longitude, and the boolean whether
+            order of interactions matters.
+
+        Raises:
+            HTTPError 400 if the latitude or longitude is not a finite
+                number, or the edges parameter is not valid.
         """
-        latitude = float(self.get_argument('latitude'))
-        longitude = float(self.get_argument('longitude'))
+        try:
+            latitude = float(self.get_argument('latitude'))
+            longitude = float(self.get_argument('longitude'))
+        except ValueError:
+            raise tornado.web.HTTPError(400)  # 400 Bad Request
+        if (math.isinf(latitude) or math.isnan(latitude) or
+                math.isinf(longitude) or math.isnan(longitude)):
+            raise tornado.web.HTTPError(400)  # 400 Bad Request
         edges = self.get_argument('edges')
         if edges == 'directed':
             directed = True
@@ -60,99 +420,455 @@ class InteractionHandler(MainHandler):
             directed = False
         else:
             raise tornado.web.HTTPError(400)  # 400 Bad Request
+        return latitude, longitude, directed
 
-        point = shapely.geometry.Point(longitude, latitude)
-        block_id = process.point_to_block(point, self.blocks)
-        if block_id in self.interactions:
-            interactions = copy.deepcopy(self.interactions[block_id])
-            if not directed:
-                self._add_undirected(block_id, interactions)
-            interactions = self._normalized_interaction_counts(interactions)
-            blocks = self._prepare_blocks(interactions)
-        else:
-            blocks = []
+    def _time_window(self):
+        """Parse the GET parameters of the time window of a query.
+
+        GET Parameters:
+            hour_from: Integer of the first hour of day (UTC), from 0 to
+                23. (Default: 0)
+            hour_to: Integer of the hour of day (UTC) at which the
+                window ends, from 0 to 24, wrapping around midnight if
+                it is not after `hour_from`. (Default: 24)
+            weekday: Comma separated integers of the days of the week
+                on which the window starts, where Monday is 0. The hours
+                after midnight of a window that wraps around midnight
+                are on the following day. (Default: every day)
 
-        self.render('interaction.html',
-                    box=self.box,
-                    latitude=latitude,
-                    longitude=longitude,
-                    directed=directed,
-                    source_id=block_id,
-                    blocks=blocks,
-                    color_code=self._color_code,
-                    git_version=self.git_version)
+        Returns:
+            Tuple of the `hour_from`, `hour_to`, and list of weekdays or
+            None, as used by `process.time_buckets`, or None if none of
+            the parameters are given.
 
-    def _add_undirected(self, block_id, interactions):
-        """Add counts for the reverse interaction edges.
+        Raises:
+            HTTPError 400 if a parameter is not valid.
+        """
+        hour_from = self.get_argument('hour_from', '')
+        hour_to = self.get_argument('hour_to', '')
+        weekday = self.get_argument('weekday', '')
+        if not (hour_from or hour_to or weekday):
+            return None
+        try:
+            hour_from = int(hour_from) if hour_from else 0
+            hour_to = int(hour_to) if hour_to else 24
+            weekdays = None
+            if weekday:
+                weekdays = [int(x) for x in weekday.split(',')]
+        except ValueError:
+            raise tornado.web.HTTPError(400)  # 400 Bad Request
+        if (not 0 <= hour_from <= 23 or not 0 <= hour_to <= 24 or
+                not all(0 <= x <= 6 for x in weekdays or [])):
+            raise tornado.web.HTTPError(400)  # 400 Bad Request
+        return hour_from, hour_to, weekdays
+
+    def _color_code(self, weight):
+        """Converts float [0.0 - 1.0] to HTML color code."""
+        weight = 1 - weight
+        rgb = colorsys.hsv_to_rgb(weight / 2, 1, 0.75)
+        code = '#' + ''.join([hex(int(x * 256))[2:].zfill(2) for x in rgb])
+        return code
+
+
+class ApiHandler(MainHandler):
+    """Base class for the cacheable JSON API handlers."""
+
+    def initialize(self):
+        super(ApiHandler, self).initialize()
+        self.dataset_version = self.application.settings.get(
+            'dataset_version')
+
+    def compute_etag(self):
+        """Disable hashing the response body to compute an ETag."""
+        return None
+
+    def _not_modified(self, *key):
+        """Set the caching headers and check the request's ETag.
+
+        The ETag depends only on the `key` that identifies the response,
+        the dataset version, and the code version, so it can be checked
+        before the response is built. Browsers and proxies may store the
+        response, but must revalidate it with the ETag before using it,
+        so that they never use a response from before the interactions
+        were reloaded.
 
         Args:
-            block_id: The source block ID.
-            interactions: Dictionary of the directed interactions for
-                the `block_id`.
+            key: Values that identify the response.
 
         Returns:
-            The `interactions` dictionary updated with reverse counts.
+            True if the client already has the response, in which case
+            the status is set to 304 Not Modified.
         """
-        for target_id in self.interactions:
-            if (block_id not in self.interactions[target_id] or
-                    target_id == block_id):
-                continue
-            if target_id not in interactions:
-                interactions[target_id] = 0
-            interactions[target_id] += self.interactions[target_id][block_id]
+        etag = hashlib.sha1(json.dumps([self.dataset_version,
+                                        self.git_version[1]] + list(key)))
+        self.set_header('Etag', '"{0}"'.format(etag.hexdigest()))
+        self.set_header('Cache-Control', 'public, no-cache')
+        if self.check_etag_header():
+            self.set_status(304)
+            return True
+        return False
 
-    def _normalized_interaction_counts(self, interactions):
-        """Normalize the interaction value to between 0 and 1.
 
-        Args:
-            interactions: Dictionary of blocks with interaction value.
+class InteractionApiHandler(ApiHandler, InteractionHandler):
+    """Handles the census block interaction query as JSON."""
 
-        Returns:
-            Original dictionary with normalized values (0 <= x <= 1).
+    def initialize(self):
+        super(InteractionApiHandler, self).initialize()
+        self.executor = self.application.settings.get('query_executor')
+
+    @tornado.gen.coroutine
+    def get(self):
+        """Writes the census block interactions as JSON.
+
+        The block lookup and the interactions are computed by the
+        `QueryExecutor`, so that other requests are served meanwhile.
+        The `Server-Timing` header of the response has the milliseconds
+        the query waited for a worker (`queue`) and ran in the worker
+        (`compute`).
+
+        GET Parameters:
+            latitude: Float of the latitude coordinate.
+            longitude: Float of the longitude coordinate.
+            edges: String, either 'directed' or 'undirected', indicating
+                whether order of interactions matters.
+            hour_from, hour_to, weekday: Optional time window, as used
+                by `_time_window`, which counts only the interactions
+                whose target check-in was made during the window. The
+                interactions must have been counted by time.
+
+        Response:
+            JSON object with the `source_id` of the census block that
+            contains the point (or null), and a `blocks` list with an
+            object for each related block with its `id`, normalized
+            `weight` between 0 and 1, HTML `color` code, and encoded
+            polyline `path`.
+        """
+        latitude, longitude, directed = self._query_arguments()
+        window = self._time_window()
+        buckets = None
+        if window is not None:
+            if self.interactions.buckets == 1:
+                raise tornado.web.HTTPError(
+                    400, 'The interactions were not counted by time.')
+            buckets = tuple(process.time_buckets(*window))
+        with self._phase('lookup'):
+            block_id, queue_time, compute_time = yield self.executor.run(
+                find_block, longitude, latitude)
+        if self._not_modified('interaction', block_id, directed, buckets):
+            return
+
+        with self._phase('assembly'):
+            # The dataset version is part of the key, so that a query
+            # that was running when the interactions were reloaded cannot
+            # add a stale result.
+            key = (self.dataset_version, block_id, directed, buckets)
+            blocks = self.response_cache.get(key)
+            if blocks is None:
+                blocks, queue, compute = yield self.executor.run(
+                    interaction_blocks, block_id, directed, buckets)
+                queue_time += queue
+                compute_time += compute
+                self.response_cache[key] = blocks
+            response = {'source_id': block_id,
+                        'directed': directed,
+                        'blocks': [{'id': target_id,
+                                    'weight': weight,
+                                    'color': self._color_code(weight),
+                                    'path': path}
+                                   for target_id, path, weight in blocks]}
+        self.set_header('Server-Timing',
+                        'queue;dur={0:.3f}, compute;dur={1:.3f}'.format(
+                            queue_time * 1e3, compute_time * 1e3))
+
+        with self._phase('render'):
+            self.write(response)
+
+
+class BlockApiHandler(ApiHandler):
+    """Handles the census block geometry query as JSON."""
+
+    def get(self, block_id):
+        """Writes the outline of a census block as JSON.
+
+        Response:
+            JSON object with the block `id` and the encoded polyline
+            `path` of its outline.
         """
-        maximum = max(interactions.values())
-        for block in interactions:
-            interactions[block] /= maximum
-        return interactions
+        if block_id not in self.blocks:
+            raise tornado.web.HTTPError(404)  # 404 Not Found
+        if self._not_modified('block', block_id):
+            return
+        with self._phase('render'):
+            self.write({'id': block_id, 'path': self.block_paths[block_id]})
 
-    def _prepare_blocks(self, interactions):
-        """Use interactions to prepare census blocks to be rendered.
 
-        Args:
-            interactions: Dictionary of blocks with interaction value.
+class StatusHandler(tornado.web.RequestHandler):
+    """Handles requests for the server status."""
 
-        Returns:
-            List of tuples: (target_block_id, shape, weight).
+    def get(self):
+        """Writes the dataset version and counters as JSON.
+
+        The `queue_time` and `compute_time` of the query executor are
+        the total seconds the finished queries waited for a worker and
+        ran in a worker.
         """
-        blocks = []
-        for target_block_id in interactions:
-            shape = self.blocks[target_block_id]
-            weight = interactions[target_block_id]
-            blocks.append((target_block_id, shape, weight))
-        return blocks
+        settings = self.application.settings
+        cache = settings.get('response_cache')
+        executor = settings.get('query_executor')
+        self.write({'dataset_version': settings.get('dataset_version'),
+                    'response_cache': {'size': len(cache),
+                                       'max_size': cache.max_size,
+                                       'hits': cache.hits,
+                                       'misses': cache.misses},
+                    'query_executor': {
+                        'pending': executor.pending,
+                        'max_pending': executor.max_pending,
+                        'rejected': executor.rejected,
+                        'finished': executor.finished,
+                        'queue_time': executor.queue_time,
+                        'compute_time': executor.compute_time}})
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Handles requests for the metrics of the server."""
 
-    def _color_code(self, weight):
-        """Converts float [0.0 - 1.0] to HTML color code."""
-        weight = 1 - weight
-        rgb = colorsys.hsv_to_rgb(weight / 2, 1, 0.75)
-        code = '#' + ''.join([hex(int(x * 256))[2:].zfill(2) for x in rgb])
-        return code
+    def get(self):
+        """Writes the `ServerMetrics` in the Prometheus text format."""
+        self.set_header('Content-Type', metrics.CONTENT_TYPE)
+        self.write(self.application.settings['metrics'].registry
+                   .exposition())
+
+
+class InteractionReloader(object):
+    """Reloads the interactions of a running application.
+
+    The new interactions are loaded in a background thread, and then
+    swapped into the application settings on the IOLoop thread, so that
+    requests keep being served with the old interactions meanwhile. Each
+    request uses the settings from when it started.
+
+    Attributes:
+        path: String of the path of the interactions file.
+        version_paths: List of the paths of the data files passed to
+            `get_dataset_version` to get the version of the reloaded
+            dataset.
+        reloads: Number of times the interactions were reloaded.
+    """
 
+    def __init__(self, application, path, version_paths=None):
+        """Creates a new reloader.
 
-def start_server(config, blocks, interactions, git_version):
-    application = tornado.web.Application(
-        [(r'/', MainHandler),
-         (r'/interaction/blocks', InteractionHandler)],
+        Args:
+            application: The `tornado.web.Application` to update.
+            path: String of the path of the interactions file saved by
+                `process.dump_interactions`.
+            version_paths: List of the paths of the data files used by
+                the application. (Default: None, which uses the `path`.)
+        """
+        self.application = application
+        self.path = path
+        self.version_paths = version_paths or [path]
+        self.reloads = 0
+        self._loaded_key = self._seen_key = self._key()
+        self._loading = False
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    def _key(self):
+        try:
+            return process._archive_key(self.path)
+        except OSError:
+            return None
+
+    def check(self):
+        """Reload the interactions if the file has changed.
+
+        The file must be unchanged since the previous check, so that a
+        file that is still being written is not loaded.
+        """
+        key = self._key()
+        if key is not None and key == self._seen_key != self._loaded_key:
+            self.reload()
+        self._seen_key = key
+
+    @tornado.gen.coroutine
+    def reload(self):
+        """Load the interactions file and swap it into the application.
+
+        The dataset version is updated, which changes the ETags of the
+        API responses, and the response cache is cleared.
+        """
+        if self._loading:
+            return
+        logger = logging.getLogger('ui.web')
+        self._loading = True
+        try:
+            key = self._key()
+            interactions = yield self._executor.submit(
+                process.load_interaction_matrix, self.path)
+            dataset_version = get_dataset_version(*self.version_paths)
+        except (IOError, OSError, ValueError):
+            logger.exception('Could not reload the interactions')
+            return
+        finally:
+            self._loading = False
+        settings = self.application.settings
+        settings['interactions'] = interactions
+        settings['dataset_version'] = dataset_version
+        settings['response_cache'].clear()
+        settings['query_executor'].restart()
+        self._loaded_key = key
+        self.reloads += 1
+        logger.info('Reloaded the interactions, dataset version: '
+                    '{0}'.format(dataset_version))
+
+
+def make_application(config, blocks, interactions, git_version,
+                     dataset_version=None, worker=None):
+    """Create the web application.
+
+    Args:
+        config: An instance of ConfigParser with the settings.
+        blocks: A `process.BlockIndex` of the census blocks.
+        interactions: A `process.InteractionMatrix` of the census
+            block interactions, or a dictionary of block IDs with a
+            dictionary that stores how many times the source block
+            interacted with the target block.
+        git_version: Tuple as returned by `get_git_version`.
+        dataset_version: String that changes whenever the `blocks` or
+            `interactions` change, used for the API ETags, such as from
+            `get_dataset_version`. (Default: None, which uses a random
+            version.)
+        worker: Number of the server process, such as from
+            `tornado.process.task_id`, or None if the server does not
+            fork. Each request to a forked server may be answered by a
+            different process, so the application of a forked process
+            does not serve `/metrics`, which is served on a port of its
+            own by `serve_metrics` instead. (Default: None)
+
+    Returns:
+        The `Application` object. Its `query_executor` setting is the
+        `QueryExecutor`, which should be shut down when the application
+        is no longer served.
+    """
+    if dataset_version is None:
+        dataset_version = uuid.uuid4().hex
+    if not isinstance(interactions, process.InteractionMatrix):
+        interactions = process.InteractionMatrix.from_dict(interactions)
+    # Debug mode reloads the server when the code changes, which cannot
+    # be done for processes forked by `start_server`.
+    debug = (config.getboolean('web', 'debug') and
+             get_setting(config, 'web', 'processes', 'getint') == 1)
+    handlers = [(r'/', MainHandler),
+                (r'/interaction/blocks', InteractionHandler),
+                (r'/api/interaction/blocks', InteractionApiHandler),
+                (r'/api/blocks/([^/]+)', BlockApiHandler),
+                (r'/status', StatusHandler)]
+    if worker is None:
+        handlers.append((r'/metrics', MetricsHandler))
+    application = Application(
+        handlers,
         template_path=os.path.join(os.path.dirname(__file__), 'templates'),
         static_path=os.path.join(os.path.dirname(__file__), 'static'),
         gzip=config.getboolean('web', 'gzip'),
-        debug=config.getboolean('web', 'debug'),
+        debug=debug,
         box=json.loads(config.get('place', 'box')),
         blocks=blocks,
         interactions=interactions,
-        git_version=git_version)
+        block_paths=process.EncodedBlocks(
+            blocks, get_setting(config, 'web', 'simplify_tolerance',
+                                'getfloat')),
+        response_cache=LRUCache(get_setting(config, 'web', 'cache_size',
+                                            'getint')),
+        dataset_version=dataset_version,
+        git_version=git_version,
+        worker=worker)
+    application.settings['query_executor'] = QueryExecutor(
+        get_setting(config, 'web', 'executor'),
+        get_setting(config, 'web', 'executor_workers', 'getint'),
+        get_setting(config, 'web', 'max_pending', 'getint'),
+        application.settings)
+    return application
+
+
+def serve_metrics(application, port):
+    """Serve the metrics of an application on a port of their own.
+
+    Args:
+        application: The `Application` whose `ServerMetrics` are served
+            at `/metrics`.
+        port: The port number to listen on.
+
+    Returns:
+        The `tornado.httpserver.HTTPServer`.
+    """
+    metrics_application = tornado.web.Application(
+        [(r'/metrics', MetricsHandler)],
+        metrics=application.settings['metrics'])
+    http_server = tornado.httpserver.HTTPServer(metrics_application)
+    http_server.listen(port)
+    return http_server
+
+
+def start_server(config, blocks, interactions, git_version,
+                 dataset_version=None, interactions_path=None,
+                 version_paths=None):
+    """Serve the web application until interrupted.
+
+    If the `[web] processes` setting is not 1, then that many worker
+    processes are forked after the listening socket is bound (0 forks
+    one per CPU). The `blocks` and `interactions` are loaded before the
+    fork, so the workers share them; when loaded by
+    `process.load_blocks` and `process.load_interaction_matrix` their
+    arrays are memory-mapped, so the pages stay shared even as Python
+    reference counts change. Each forked process serves its metrics at
+    `/metrics` on the `[web] metrics_port` plus its task ID, from 0, if
+    that setting is not 0.
+
+    If the `interactions_path` is given, the interactions are reloaded
+    by an `InteractionReloader` when the file changes, checked every
+    `[web] reload_interval` seconds, or when the server process receives
+    SIGHUP. When there are several server processes, each one reloads
+    on its own, and the parent process ignores SIGHUP. Only the first
+    of them compiles the changed file with
+    `process.load_interaction_matrix`, and the others memory-map it.
+
+    Args:
+        config: An instance of ConfigParser with the settings.
+        blocks: A `process.BlockIndex` of the census blocks.
+        interactions: A `process.InteractionMatrix` of the census
+            block interactions.
+        git_version: Tuple as returned by `get_git_version`.
+        dataset_version: String as used by `make_application`.
+        interactions_path: String of the path of the interactions file
+            to reload. (Default: None, which never reloads.)
+        version_paths: List of the paths passed to `get_dataset_version`
+            after reloading, as used by `InteractionReloader`.
+    """
+    sockets = tornado.netutil.bind_sockets(config.getint('web', 'port'))
+    processes = get_setting(config, 'web', 'processes', 'getint')
+    if processes != 1:
+        if interactions_path is not None:
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        tornado.process.fork_processes(processes)
+    worker = tornado.process.task_id()
+    application = make_application(config, blocks, interactions, git_version,
+                                   dataset_version, worker)
     http_server = tornado.httpserver.HTTPServer(application, xheaders=True)
-    http_server.listen(config.getint('web', 'port'))
+    http_server.add_sockets(sockets)
+    metrics_port = get_setting(config, 'web', 'metrics_port', 'getint')
+    if worker is not None and metrics_port:
+        serve_metrics(application, metrics_port + worker)
+
+    if interactions_path is not None:
+        reloader = InteractionReloader(application, interactions_path,
+                                       version_paths)
+        interval = get_setting(config, 'web', 'reload_interval', 'getfloat')
+        if interval > 0:
+            tornado.ioloop.PeriodicCallback(reloader.check,
+                                            interval * 1000).start()
+        io_loop = tornado.ioloop.IOLoop.current()
+        signal.signal(signal.SIGHUP, lambda signum, frame:
+                      io_loop.add_callback_from_signal(reloader.reload))
 
     try:
         tornado.ioloop.IOLoop.instance().start()
@@ -180,6 +896,23 @@ def get_git_version():
     return git_version, git_commit
 
 
+def get_dataset_version(*paths):
+    """Identify the version of the data files used by the server.
+
+    Args:
+        paths: Strings of the paths of the data files.
+
+    Returns:
+        String hash of the path, size, and modification time of each
+        file.
+    """
+    key = []
+    for path in paths:
+        stat = os.stat(path)
+        key.append([os.path.abspath(path), stat.st_size, stat.st_mtime])
+    return hashlib.sha1(json.dumps(key)).hexdigest()
+
+
 def setup_logging(config):
     if config.getboolean('web', 'debug'):
         log_level = logging.DEBUG
@@ -227,14 +960,24 @@ if __name__ == '__main__':
     print 'Extracting census blocks ...',
     census_path = config.get('census', 'path')
     census_blocks = config.get('census', 'blocks')
-    blocks = process.extract_blocks(os.path.join(census_path, census_blocks))
+    blocks = process.load_blocks(os.path.join(census_path, census_blocks))
+    blocks = process.BlockIndex(blocks)
     print 'DONE'
 
     print 'Loading census block interactions ...',
-    with open('census-block-interactions.tsv') as f:
-        interactions = process.load_interactions(f)
+    # Prefer the interactions counted by time, which also answer queries
+    # with a time window, but fall back to files saved before they were.
+    interactions_path = 'census-block-interactions-by-time.tsv'
+    if not os.path.exists(interactions_path):
+        interactions_path = 'census-block-interactions.tsv'
+    interactions = process.load_interaction_matrix(interactions_path)
     print 'DONE'
 
+    version_paths = [os.path.join(census_path, census_blocks),
+                     interactions_path]
+    dataset_version = get_dataset_version(*version_paths)
+
     logger.info('Starting web server on port {}'.format(config.getint('web',
                                                                       'port')))
-    start_server(config, blocks, interactions, (git_version, git_commit))
+    start_server(config, blocks, interactions, (git_version, git_commit),
+                 dataset_version, interactions_path, version_paths)
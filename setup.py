@@ -14,7 +14,7 @@ with open('README.md') as f:
 setup(
     name=PROGRAM_NAME,
     version=VERSION,
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
 
     install_requires=REQUIREMENTS,
 